@@ -1,22 +1,25 @@
 #!/usr/bin/env python3
 # Note: start experiment from the paper with: python3 e2e -s0 -n1000 -p200
 import getopt
+import json
 import sys
+import time
 
 import benchmark_WATERS as bench
-from tasks.taskset import transform
 import helpers
 import analysis as ana
+import store
+import columnar
+import cache
+import instrument
 
 import random
 import numpy as np
+from collections import Counter, deque
+from functools import partial
 from multiprocessing import Pool
 import plot
 
-from copy import (
-    deepcopy,
-)  # to duplicate the system under analysis. TODO do we need this?
-
 # set seed
 random.seed(314159)
 np.random.seed(314159)
@@ -57,16 +60,51 @@ class AnaRes:
 
         self.res_dict[spor][let][analysis] = vals
 
+    @classmethod
+    def from_results(cls, results):
+        """Analysis results from {(spor, let, analysis): vals} (e.g., the shards of columnar.load_results())."""
+        ana_res = cls()
+        for (spor, let, analysis), vals in results.items():
+            ana_res.store_res(spor=spor, let=let, analysis=analysis, vals=vals)
+        return ana_res
+
+    def extend_res(self, spor, let, analysis, vals):
+        """Append values to an analysis result (stored as list)."""
+        if analysis not in self.res_dict.get(spor, dict()).get(let, dict()):
+            self.store_res(spor, let, analysis, vals=[])
+        self.res_dict[spor][let][analysis].extend(vals)
+
     def results(self, spor, let, analysis):
         """Get analysis result."""
         return self.res_dict[spor][let][analysis]
 
+    def items(self):
+        """((spor, let, analysis), result) for all stored results."""
+        return [((spor, let, analysis), vals)
+                for spor, let_dict in self.res_dict.items()
+                for let, ana_dict in let_dict.items()
+                for analysis, vals in ana_dict.items()]
+
+
+def _check_base_ts(ts, ces):
+    """Debug: chains are based on their task set."""
+    for ce in ces:
+        assert ce.base_ts == ts
+    return True
+
 
 ##
 # Handle Options
 ##
-opts, args = getopt.getopt(sys.argv[1:], "s:p:n:")
-
+opts, args = getopt.getopt(sys.argv[1:], "s:p:n:c:rib:t:",
+                           ["resume", "cache=", "instrument", "budget=", "budget-time=", "timebase="])
+
+chunksize = 64  # chains per task sent to a worker in step 2
+timebase = None  # step 1: tolerance of the time base of the task sets (see tasks.taskset.transform)
+resume = False  # step 2: skip configurations whose results have already been written
+cache_path = None  # step 2: file of the persistent result cache (None: results are only cached in memory)
+instrumentation = False  # steps 1 and 2: count calls, iterations and time of TDA and analyses (see instrument.py)
+budget = (None, None)  # step 2: iterations per periodic segment and seconds per chain of Mix and Improved
 for opt, arg in opts:
     if opt == "-s":  # define which part of the code is being executed
         code_switch = int(arg)
@@ -74,6 +112,20 @@ for opt, arg in opts:
         processors = int(arg)
     elif opt in "-n":  # number
         number = int(arg)
+    elif opt in "-c":  # chunk size for the workers in step 2
+        chunksize = int(arg)
+    elif opt in ["-r", "--resume"]:  # resume an interrupted step 2
+        resume = True
+    elif opt == "--cache":  # keep the step 2 results of each chain in this file for later runs
+        cache_path = arg
+    elif opt in ["-i", "--instrument"]:  # report of the TDA in step 1 and of the analyses in step 2
+        instrumentation = True
+    elif opt in ["-b", "--budget"]:  # step 2: upper bound instead of periodic segments with more iterations
+        budget = (int(arg), budget[1])
+    elif opt == "--budget-time":  # step 2: upper bound for the remaining periodic segments after this time
+        budget = (budget[0], float(arg))
+    elif opt in ["-t", "--timebase"]:  # step 1: coarsest time base within this tolerance (relative to the period)
+        timebase = float(arg)
     else:
         breakpoint()
 
@@ -84,56 +136,44 @@ utils = [0.5, 0.6, 0.7, 0.8, 0.9]
 ##
 if code_switch in [0, 1]:
     """Make 'number' many task sets, generate ce_chains accordingly, discard those that have no ce_chains,
-    set phase to 0, transform the tasks, store.
-    Please note: Task sets are periodic with phase=0 and implicit deadline, and have implicit communication."""
-    # set seed
-    random.seed(314159)
-    np.random.seed(314159)
+    set random phase, transform the tasks, store.
+    Please note: Task sets are periodic with implicit deadline, and have implicit communication."""
+    # Seeds: one per task set, derived from the global seed (independent of the number of processors)
+    ut_seeds = np.random.SeedSequence(314159).spawn(len(utils))
+
+    helpers.check_or_make_directory(path1)
+    reports = dict()  # utilization -> instrumentation registry of all workers
+    with Pool(processors, initializer=instrument.enable, initargs=(instrumentation,)) as p:
+        for ut, ut_seed in zip(utils, ut_seeds):
+            print(f"{helpers.time_now()}: Utilization={ut}")
+            report = reports.setdefault(f"u={ut}", dict())
+            # Make "number" many tasksets, in groups of 8 per worker task (at most 4 groups per processor are queued).
+            # Each task set is ordered by deadline, has random phases and implicit communication, is transformed,
+            # and gets its wcrts and 30 to 60 cause-effect chains (some of them may be discarded during generation).
+            # Task sets with wcrt > dl or without ce_chains are discarded (None).
+            seeds = ut_seed.spawn(number)
+            ts_ces = (
+                ts_ce
+                for ts_ces_group in helpers.imap_bounded(
+                    p,
+                    partial(bench.gen_tasksets_chains, ut, timebase=timebase),
+                    [seeds[idx : idx + 8] for idx in range(0, number, 8)],
+                    chunksize=1,
+                    max_pending=4 * processors,
+                    worker_stats=partial(instrument.snapshot, reset=True),
+                    merge_stats=partial(instrument.merge, report),
+                )
+                for ts_ce in ts_ces_group
+                if ts_ce is not None
+            )
 
-    for ut in utils:
-        print(f"{helpers.time_now()}: Utilization={ut}")
-        # Make "number" many tasksets
-        ts_sets = [bench.gen_taskset(ut) for _ in range(number)]
-
-        # Order by Deadline
-        for ts in ts_sets:
-            ts.sort_dm()
-
-        # Modify tasks
-        for ts in ts_sets:
-            for tsk in ts:
-                # # Set phase to 0
-                # tsk.rel.phase = 0
-                # Draw random phase
-                tsk.rel.phase = random.random() * tsk.rel.period
-                # Make implicit communication
-                tsk.add_feature("communication", "implicit")
-            # Transform task sets
-            transform(ts)
-            # TDA
-            ts.compute_wcrts()
-
-        # Remove task sets with wcrt > dl
-        ts_sets = [
-            ts for ts in ts_sets if all([tsk.dl.dl >= ts.wcrts[tsk] for tsk in ts])
-        ]
-
-        # Generate 30 to 60 cause-effect chains for each task set (some of them may be discarded during generation)
-        ce_sets = [bench.gen_ce_chains(ts) for ts in ts_sets]
-
-        # Discard those without ce_chains and match ts with ce_set
-        ts_ces = [
-            (ts, ce_set) for ts, ce_set in zip(ts_sets, ce_sets) if len(ce_set) != 0
-        ]
-
-        if __debug__:
-            for ts, ces in ts_ces:
-                for ce in ces:
-                    assert ce.base_ts == ts
-
-        # Store data
-        helpers.check_or_make_directory(path1)
-        helpers.write_data(path1 + f"ts_ces_n={number}_u={ut}.pickle", ts_ces)
+            if __debug__:
+                ts_ces = (ts_ce for ts_ce in ts_ces if _check_base_ts(*ts_ce))
+
+            # Store data (columnar, see columnar.py)
+            columnar.write_task_sets_chains(path1 + f"ts_ces_n={number}_u={ut}", ts_ces, timebase=timebase)
+    if instrumentation:
+        instrument.dump(path1 + f"instrumentation_n={number}", reports)
 
 ##
 # Do analyses
@@ -145,44 +185,134 @@ if code_switch in [0, 2]:
     random.seed(314159)
     np.random.seed(314159)
 
-    # Load data
-    ts_ces_all = []
+    # Load data (memory-mapped, no task objects are created)
+    dirnames = []
     for ut in utils:
-        ts_ces_all.extend(helpers.load_data(path1 + f"ts_ces_n={number}_u={ut}.pickle"))
+        dirname = path1 + f"ts_ces_n={number}_u={ut}"
+        if not columnar.exists(dirname):  # pickle of earlier versions
+            columnar.write_task_sets_chains(dirname, helpers.load_stream(dirname + ".pickle"))
+        dirnames.append(dirname)
+    datasets = [columnar.load_task_sets_chains(dirname) for dirname in dirnames]
 
     ana_res = AnaRes()  # store analysis results here
-
-    # iterate through cases
-    for spor_rat, LET_rat in [(sp, let) for sp in spor_ratios for let in LET_ratios]:
-        # Copy task set
-        ts_ces = deepcopy(ts_ces_all)
-
-        # Modify the tasks
-        for ts, _ in ts_ces:
-            for tsk in random.sample(ts[:], int(len(ts) * spor_rat)):
-                tsk.rel.type = "sporadic"
-            for tsk in random.sample(ts[:], int(len(ts) * LET_rat)):
-                tsk.comm.type = "LET"
-
-        # Flat list
-        ces = [ce for _, ces in ts_ces for ce in ces]
-
-        # Do analyses
-        with Pool(processors) as p:
-            res_pess = p.map(ana.mix_pessimistic, ces)
-            res_mix = p.map(ana.mix, ces)
-            res_mix_improved = p.map(ana.mix_improved, ces)
-
-        # Store in Analysis object
-        ana_res.store_res(spor=spor_rat, let=LET_rat, analysis="Pess", vals=res_pess)
-        ana_res.store_res(spor=spor_rat, let=LET_rat, analysis="Mix", vals=res_mix)
-        ana_res.store_res(
-            spor=spor_rat, let=LET_rat, analysis="Improved", vals=res_mix_improved
-        )
-
-    # Store analysis result object
-    helpers.check_or_make_directory(path2)
-    helpers.write_data(path2 + f"ana_res_n={number}.pickle", ana_res)
+    res_dir = path2 + f"ana_res_n={number}"  # one shard per (spor, let, analysis)
+    analysis_names = ["Pess", "Mix", "Improved"]
+    configs = [(sp, let) for sp in spor_ratios for let in LET_ratios]
+    # One seed per configuration, so that the results do not depend on which configurations are (re)computed
+    config_seeds = np.random.SeedSequence(314159).spawn(len(configs))
+
+    # Parameters the results depend on (besides the seeds); existing results are only resumed with the same ones
+    digests = [data.digest() for data in datasets]
+    params = {"budget": list(budget), "timebase": [data.timebase() for data in datasets], "data": digests}
+    done = []  # results of this run (or resumed), in the order of configs
+    if resume and any(columnar.result_exists(res_dir, sp, let, analysis)
+                      for sp, let in configs for analysis in analysis_names):
+        if columnar.load_params(res_dir) != params:
+            raise ValueError(f"Results in {res_dir} were computed with {columnar.load_params(res_dir)}, not with"
+                             f" {params}. Run step 2 without -r.")
+
+    # Pess, Mix and Improved are computed together for each chain (periodic segments with the default engine 'sweep',
+    # which is the fastest on WATERS chains, see microbench.py)
+    analyses = partial(store.evaluate_job, (ana.mix_pessimistic, ana.mix, ana.mix_improved))
+
+    # Results per chain and release/communication types (the same chain often has the same types in several
+    # configurations); keys contain the content hash of the data set
+    res_cache = cache.LRUCache(path=cache_path)
+
+    # Results with a budget may be approximate, so they are only reused with the same budget
+    key_prefix = ("Pess,Mix,Improved",) if budget == (None, None) else ("Pess,Mix,Improved", "budget", *budget)
+
+    def job_key(job):
+        data_id, *chain = job
+        return (*key_prefix, digests[data_id], *chain)
+
+    reports = dict()  # configuration -> instrumentation registry of all workers
+    budget_report = dict()  # configuration -> chains with approximate results
+
+    # One pool for all cases (the workers read the task sets from the data sets)
+    with Pool(processors, initializer=store.attach_data, initargs=(dirnames, instrumentation, budget)) as p:
+        # iterate through cases
+        for (spor_rat, LET_rat), config_seed in zip(configs, config_seeds):
+            if resume and all(columnar.result_exists(res_dir, spor_rat, LET_rat, analysis)
+                              for analysis in analysis_names):
+                print(f"{helpers.time_now()}: {spor_rat=}, {LET_rat=}: results exist, skipped")
+                done += [(spor_rat, LET_rat, analysis) for analysis in analysis_names]
+                continue
+
+            # Configurations without chains have empty results
+            for analysis in analysis_names:
+                ana_res.store_res(spor=spor_rat, let=LET_rat, analysis=analysis, vals=[])
+
+            # Jobs for the chains of one task set after the other, each with its drawn sporadic and LET tasks
+            # (the task sets are not copied or modified)
+            rng = random.Random(int(config_seed.generate_state(1, np.uint64)[0]))
+            jobs = store.scenario_jobs(datasets, spor_rat, LET_rat, rng)
+
+            # Jobs whose results have not been returned yet (the results come in the same order)
+            taken = deque()
+
+            def take(jobs):
+                for job in jobs:
+                    taken.append(job)
+                    yield job
+
+            # Do analyses of the chains that are not cached (at most 4 chunks per processor are queued)
+            # and store the results as they come in
+            start = time.perf_counter()
+            count = 0
+            res_cache.reset_stats()
+            segment_stats = Counter()  # segment cache of the periodic analyses (all workers)
+            report = reports.setdefault(f"spor={spor_rat}_let={LET_rat}", dict())
+            approximate_chains = budget_report.setdefault(f"spor={spor_rat}_let={LET_rat}", [])
+
+            def merge_stats(stats):
+                segment_stats.update(stats[0])
+                instrument.merge(report, stats[1])
+
+            compute = partial(helpers.imap_bounded, p, analyses, chunksize=chunksize, max_pending=4 * processors,
+                              worker_stats=store.worker_stats, merge_stats=merge_stats)
+            for res, approximate in cache.map_cached(res_cache, compute, take(jobs), key=job_key):
+                data_id, ts_id, task_indices, *_ = taken.popleft()
+                for analysis, val in zip(analysis_names, res):
+                    ana_res.extend_res(spor=spor_rat, let=LET_rat, analysis=analysis, vals=[val])
+                if approximate:
+                    approximate_chains.append({"data": dirnames[data_id], "task_set": ts_id,
+                                               "tasks": list(task_indices), "chain": count,
+                                               "analyses": [analysis_names[idx] for idx in approximate]})
+                count += 1
+            duration = time.perf_counter() - start
+            print(
+                f"{helpers.time_now()}: {spor_rat=}, {LET_rat=}: {count} chains in {duration:.2f}s"
+                f" ({count / duration:.1f} chains/s, {res_cache.hits} from cache)"
+            )
+            segment_time = segment_stats["computed"] + segment_stats["saved"]
+            print(
+                f"{helpers.time_now()}: periodic segments: {segment_stats['hits']} of"
+                f" {segment_stats['hits'] + segment_stats['misses']} from cache,"
+                f" {segment_stats['saved']:.2f}s of {segment_time:.2f}s"
+                f" ({segment_stats['saved'] / segment_time if segment_time else 0:.0%}) served from cache,"
+                f" {segment_stats['early_exits']} of {segment_stats['sweeps']} sweeps stopped early"
+            )
+            if budget != (None, None):
+                print(f"{helpers.time_now()}: {len(approximate_chains)} chains over budget (approximate results)")
+
+            # Store the results of this configuration right away (columnar, see columnar.py), with the index of all
+            # results so far and their parameters
+            for analysis in analysis_names:
+                columnar.write_result(res_dir, spor_rat, LET_rat, analysis,
+                                      ana_res.results(spor=spor_rat, let=LET_rat, analysis=analysis))
+                done.append((spor_rat, LET_rat, analysis))
+            columnar.write_index(res_dir, done, params)
+
+    res_cache.close()
+    columnar.write_index(res_dir, [(sp, let, analysis) for sp, let in configs for analysis in analysis_names], params)
+    print(f"Data written to {res_dir}")
+    if instrumentation:
+        instrument.dump(path2 + f"instrumentation_n={number}", reports)
+    if budget != (None, None):
+        with open(path2 + f"budget_n={number}.json", "w") as file:
+            json.dump({"iterations": budget[0], "seconds": budget[1], "approximate": budget_report}, file, indent=1)
+        print(f"Chains over budget written to {path2}budget_n={number}.json")
 
 ##
 # Plot data
@@ -192,8 +322,11 @@ if code_switch in [0, 3]:
     # set seed
     random.seed(314159)
     np.random.seed(314159)
-    # Load data
-    ana_res = helpers.load_data(path2 + f"ana_res_n={number}.pickle")
+    # Load data (memory-mapped result vectors; pickled AnaRes of earlier versions)
+    if columnar.exists(path2 + f"ana_res_n={number}"):
+        ana_res = AnaRes.from_results(columnar.load_results(path2 + f"ana_res_n={number}"))
+    else:
+        ana_res = helpers.load_data(path2 + f"ana_res_n={number}.pickle")
 
     analyses = ["Mix", "Improved"]
     baseline = "Pess"
@@ -1,10 +1,186 @@
 import math
 import itertools
+import time
+import weakref
+import numpy as np
+from cache import LRUCache
+from instrument import instrumented
+import instrument
 from tasks.task import Task
 from tasks.taskset import TaskSet
+from tasks.arraytaskset import ArrayCEChain, REL_TYPES, COMM_TYPES, column_values
 from cechains.chain import CEChain
 
 
+#####
+# Chain plan
+#####
+
+class ChainPlan:
+    """A cause-effect chain compiled for the analyses.
+
+    Holds per task (in chain order) the values the analyses read, so that they do not have to be looked up from the
+    task objects and the base task set again. Segments (see _cut_chain()), per-edge offsets and the final term of the
+    periodic analyses are derived once and cached.
+    Use chain_plan() to obtain the plan of a chain."""
+
+    _fields = ('periods', 'phases', 'maxiats', 'dls', 'wcrts', 'prios', 'rel_types', 'comm_types')
+
+    def __init__(self, periods, phases, maxiats, dls, wcrts, prios, rel_types, comm_types):
+        self.periods = periods
+        self.phases = phases
+        self.maxiats = maxiats
+        self.dls = dls
+        self.wcrts = wcrts
+        self.prios = prios
+        self.rel_types = rel_types
+        self.comm_types = comm_types
+        self.span = None  # (start, stop) of a sub-plan in its plan, see segment()
+        self._segments = dict()  # (communication, release) -> list of sub-plans
+        self._offsets = dict()  # kind -> (per-edge offsets, final term)
+
+    @classmethod
+    def from_chain(cls, chain):
+        """Compile a CEChain with the current release and communication types of its tasks."""
+        base_ts = chain.base_ts
+        wcrts = getattr(base_ts, 'wcrts', dict())
+        return cls(
+            periods=[getattr(tsk.rel, 'period', None) for tsk in chain],
+            phases=[getattr(tsk.rel, 'phase', None) for tsk in chain],
+            maxiats=[tsk.rel.maxiat for tsk in chain],
+            dls=[tsk.dl.dl if hasattr(tsk, 'dl') else None for tsk in chain],
+            wcrts=[wcrts.get(tsk) for tsk in chain],
+            prios=base_ts.priorities(chain) if base_ts is not None else [None] * len(chain),
+            rel_types=[tsk.rel.type for tsk in chain],
+            comm_types=[tsk.comm.type if hasattr(tsk, 'comm') else None for tsk in chain]
+        )
+
+    @classmethod
+    def from_columns(cls, columns, rows, prios):
+        """Compile the tasks at positions 'rows' of columns (column -> array, see tasks.arraytaskset.ArrayTaskSet)
+        with their priorities prios."""
+        return cls(
+            periods=column_values(columns['period'][rows]),
+            phases=column_values(columns['phase'][rows]),
+            maxiats=column_values(columns['maxiat'][rows]),
+            dls=column_values(columns['dl'][rows]),
+            wcrts=column_values(columns['wcrt'][rows]),
+            prios=list(prios),
+            rel_types=[REL_TYPES[code] if code >= 0 else None for code in columns['rel'][rows].tolist()],
+            comm_types=[COMM_TYPES[code] if code >= 0 else None for code in columns['comm'][rows].tolist()]
+        )
+
+    def __len__(self):
+        return len(self.periods)
+
+    def key(self):
+        """All values of the plan (plans with the same key have the same results)."""
+        return tuple(tuple(getattr(self, field)) for field in self._fields)
+
+    def segment(self, start, stop):
+        """Sub-plan of the tasks start, ..., stop-1."""
+        plan = ChainPlan(*[getattr(self, field)[start:stop] for field in self._fields])
+        plan.span = (start, stop)
+        return plan
+
+    def segments(self, communication=True, release=True):
+        """Homogeneous segments, see _cut_chain()."""
+        key = (communication, release)
+        if key not in self._segments:
+            self._segments[key] = _cut_chain(self, communication=communication, release=release)
+        return self._segments[key]
+
+    def check_feature(self, feature):
+        """Same as TaskSet.check_feature() for 'comm' and 'rel'."""
+        assert feature in ['comm', 'rel']
+        types = self.comm_types if feature == 'comm' else self.rel_types
+        if all(types[0] == val for val in types):
+            return types[0]
+        else:
+            return 'mixed'
+
+    def offsets(self, kind):
+        """Per-edge offsets (Principle 2) and final term (Principle 3) of the periodic analyses.
+        kind: 'implicit' (impl_per), 'LET' (LET_per) or 'mixed' (mix_periodic)."""
+        if kind not in self._offsets:
+            if kind == 'implicit':
+                offsets = [0 if self.prios[idx] < self.prios[idx + 1] else self.wcrts[idx]
+                           for idx in range(len(self) - 1)]
+                tail = self.wcrts[-1]
+            elif kind == 'LET':
+                offsets = self.dls[:-1]
+                tail = self.dls[-1]
+            elif kind == 'mixed':
+                offsets = [_add_to_compare_value_from_table(idx, self) for idx in range(len(self) - 1)]
+                if self.comm_types[-1] == 'LET':
+                    tail = self.dls[-1]
+                elif self.comm_types[-1] == 'implicit':
+                    tail = self.wcrts[-1]
+                else:
+                    raise ValueError(f"{self.comm_types[-1]=} cannot be handled by the analysis.")
+            else:
+                raise ValueError(f"{kind=} is not in ('implicit', 'LET', 'mixed').")
+            self._offsets[kind] = (offsets, tail)
+        return self._offsets[kind]
+
+    def compile(self):
+        """Derive everything that Pess, Mix and Improved need, e.g., before sending the plan to another process."""
+        for seg in self.segments(communication=True, release=True):
+            if seg.check_feature('rel') == 'periodic':
+                seg.offsets(seg.check_feature('comm'))
+        for seg in self.segments(communication=False, release=True):
+            if seg.check_feature('rel') == 'periodic':
+                seg.offsets('mixed')
+        return self
+
+    def hyperperiod(self):
+        """Chain hyperperiod."""
+        return math.lcm(*self.periods)
+
+    def max_phase(self):
+        """Maximal phase of the chain."""
+        return max(self.phases)
+
+
+# chain -> (key, plan) of the last plan of each chain; entries disappear with their chains
+_chain_plans = weakref.WeakKeyDictionary()
+
+
+def chain_plan(chain):
+    """Plan of a chain (CEChain or tasks.arraytaskset.ArrayCEChain).
+    The values of the tasks are read on every call. The last plan of the chain (with its segments and offsets) is
+    kept for these values, so it is reused as long as the tasks, their wcrts, priorities and types do not change.
+    Plans are returned as they are."""
+    if isinstance(chain, ChainPlan):
+        return chain
+    if isinstance(chain, ArrayCEChain):
+        plan = ChainPlan.from_columns(chain.base_ts.columns, chain.indices, chain.indices.tolist())
+    else:
+        plan = ChainPlan.from_chain(chain)
+    key = plan.key()
+    cached_key, cached = _chain_plans.get(chain, (None, None))
+    if cached_key != key:
+        _chain_plans[chain] = (key, plan)
+        return plan
+    return cached
+
+
+#####
+# Instrumentation metrics (see instrument.py)
+#####
+
+def _length_metrics(result, chain, *args, **kwargs):
+    return {'length': len(chain)}
+
+
+def _periodic_metrics(result, chain, *args, **kwargs):
+    return {'length': len(chain), 'hyperperiod': chain_plan(chain).hyperperiod()}
+
+
+def _cut_metrics(result, chain, *args, **kwargs):
+    return {'length': len(chain), 'segments': len(result)}
+
+
 #####
 # Homogeneous
 #####
@@ -17,10 +193,10 @@ def davare(chain):
     - implicit
     - sporadic
     """
-    wcrts = chain.base_ts.wcrts
+    plan = chain_plan(chain)
     result = 0
-    for tsk in chain:
-        result += tsk.rel.maxiat + wcrts[tsk]
+    for maxiat, wcrt in zip(plan.maxiats, plan.wcrts):
+        result += maxiat + wcrt
     return result
 
 
@@ -30,13 +206,14 @@ def duerr(chain):
     - implicit
     - sporadic
     """
-    wcrts = chain.base_ts.wcrts
+    plan = chain_plan(chain)
+    maxiats, wcrts, prios = plan.maxiats, plan.wcrts, plan.prios
     result = 0
-    for idx in range(len(chain)):
-        if idx == len(chain) - 1 or chain.base_ts.higher_prio(chain[idx + 1], chain[idx]):
-            result += chain[idx].rel.maxiat + wcrts[chain[idx]]
+    for idx in range(len(plan)):
+        if idx == len(plan) - 1 or prios[idx + 1] < prios[idx]:
+            result += maxiats[idx] + wcrts[idx]
         else:
-            result += chain[idx].rel.maxiat + max(wcrts[chain[idx]] - chain[idx + 1].rel.maxiat, 0)
+            result += maxiats[idx] + max(wcrts[idx] - maxiats[idx + 1], 0)
     return result
 
 
@@ -47,257 +224,516 @@ def LET_spor(chain):
     - LET
     -sporadic
     """
+    plan = chain_plan(chain)
     result = 0
-    for tsk in chain:
-        result += tsk.rel.maxiat + tsk.dl.dl
+    for maxiat, dl in zip(plan.maxiats, plan.dls):
+        result += maxiat + dl
     return result
 
 
 # Periodic + Implicit
 
-def impl_per(chain):
-    """Upper bound for periodic tasks under LET.
-    - LET
+@instrumented('impl_per', _periodic_metrics)
+def impl_per(chain, engine='sweep', budget=None):
+    """Upper bound for periodic tasks under implicit communication.
+    - implicit
     - periodic
     """
-    # Compute chain hyperperiod and phase and maximum wcrt:
-    hyper = chain.hyperperiod()
-    max_phase = chain.max_phase()
-    WCRT_max = max(chain.base_ts.wcrts[tsk] for tsk in chain)
-
-    lengths = []
-
-    for mvar in itertools.count(start=1):
-        # Principle 1 and chain definition
-        zvar = _release(mvar, chain[0])
-        relvar = _release(mvar + 1, chain[0])
-
-        # check conditions
-        if relvar + chain.base_ts.wcrts[chain[0]] < max_phase:
-            continue
-        if zvar > max_phase + hyper + WCRT_max:
-            break
-
-        for this_tsk, next_tsk in zip(chain[:-1], chain[1:]):
-            # Principle 2 (Compute release of next job in the job chain)
-            if chain.base_ts.higher_prio(this_tsk, next_tsk):
-                compare_value = relvar
-            else:
-                compare_value = relvar + chain.base_ts.wcrts[this_tsk]
-            relvar = _release_after(compare_value, next_tsk)
-
-        # Principle 3
-        zprimevar = relvar + chain.base_ts.wcrts[chain[-1]]
-
-        lengths.append(zprimevar - zvar)
-
-    return max(lengths)
+    plan = chain_plan(chain)
+    offsets, tail = plan.offsets('implicit')
+    return _periodic(plan, offsets, tail, engine, budget)
 
 
 # Periodic + LET
 
-def LET_per(chain):
+@instrumented('LET_per', _periodic_metrics)
+def LET_per(chain, engine='sweep', budget=None):
     """Upper bound for periodic tasks under LET.
     - LET
     - periodic
     """
-    # Compute chain hyperperiod and phase:
-    hyper = chain.hyperperiod()
-    max_phase = chain.max_phase()
-    WCRT_max = max(chain.base_ts.wcrts[tsk] for tsk in chain)
-
-    lengths = []
-
-    for mvar in itertools.count(start=1):
-        # Principle 1 and chain definition
-        zvar = _release(mvar, chain[0])
-        relvar = _release(mvar + 1, chain[0])
-
-        # check conditions
-        if relvar + chain.base_ts.wcrts[chain[0]] < max_phase:
-            continue
-        if zvar > max_phase + hyper + WCRT_max:
-            break
-
-        for this_tsk, next_tsk in zip(chain[:-1], chain[1:]):
-            # Principle 2 (Compute release of next job in the job chain)
-            compare_value = relvar + this_tsk.dl.dl
-            relvar = _release_after(compare_value, next_tsk)
-
-        # Principle 3
-        zprimevar = relvar + chain[-1].dl.dl
-
-        lengths.append(zprimevar - zvar)
-
-    return max(lengths)
+    plan = chain_plan(chain)
+    offsets, tail = plan.offsets('LET')
+    return _periodic(plan, offsets, tail, engine, budget)
 
 
 #####
 # Mixed
 #####
 
+@instrumented('mix_pessimistic', _length_metrics)
 def mix_pessimistic(chain):
     """Pessimistic Analysis for mixed chains."""
+    plan = chain_plan(chain)
     result = 0
-    for tsk in chain:
-        if tsk.comm.type == 'implicit':
-            result += tsk.rel.maxiat + chain.base_ts.wcrts[tsk]
-        elif tsk.comm.type == 'LET':
-            result += tsk.rel.maxiat + tsk.dl.dl
+    for idx in range(len(plan)):
+        if plan.comm_types[idx] == 'implicit':
+            result += plan.maxiats[idx] + plan.wcrts[idx]
+        elif plan.comm_types[idx] == 'LET':
+            result += plan.maxiats[idx] + plan.dls[idx]
         else:
-            raise ValueError(f"{tsk.comm.type=} cannot be handled by the analysis.")
+            raise ValueError(f"{plan.comm_types[idx]=} cannot be handled by the analysis.")
 
     return result
 
 
+@instrumented('mix', _length_metrics)
 def mix(
         chain,
         impl_spor=duerr,
         impl_per=impl_per,
         let_spor=LET_spor,
-        let_per=LET_per
+        let_per=LET_per,
+        engine='sweep',
+        budget=None
 ):
-    """Our analysis. Cut to make homogeneous, then apply analyses."""
-    cutted_chains = _cut_chain(chain, communication=True, release=True)
+    """Our analysis. Cut to make homogeneous, then apply analyses.
+    engine: engine of the periodic analyses, see _periodic().
+    budget: Budget of the periodic analyses (None: budget of this process, see set_budget()).
+    impl_per and let_per only receive engine and budget if they are not the defaults, so any f(chain) can be used.
+    Analyses other than those of this module get the segments as chains of the same kind as chain
+    (see _segment_chain())."""
+    plan = chain_plan(chain)
+    budget = budget if budget is not None else _budget
+    budget.start()
+    periodic_kwargs = _periodic_kwargs(engine, budget)
     result = 0
-    for ch in cutted_chains:
-        if ch.check_feature('comm') == 'implicit' and ch.check_feature('rel') == 'sporadic':
-            result += impl_spor(ch)
-        elif ch.check_feature('comm') == 'implicit' and ch.check_feature('rel') == 'periodic':
-            result += impl_per(ch)
-        elif ch.check_feature('comm') == 'LET' and ch.check_feature('rel') == 'sporadic':
-            result += let_spor(ch)
-        elif ch.check_feature('comm') == 'LET' and ch.check_feature('rel') == 'periodic':
-            result += let_per(ch)
+    for seg in plan.segments(communication=True, release=True):
+        comm, rel = seg.comm_types[0], seg.rel_types[0]
+        if comm == 'implicit' and rel == 'sporadic':
+            result += impl_spor(_segment_chain(impl_spor, chain, seg))
+        elif comm == 'implicit' and rel == 'periodic':
+            result += impl_per(_segment_chain(impl_per, chain, seg), **periodic_kwargs)
+        elif comm == 'LET' and rel == 'sporadic':
+            result += let_spor(_segment_chain(let_spor, chain, seg))
+        elif comm == 'LET' and rel == 'periodic':
+            result += let_per(_segment_chain(let_per, chain, seg), **periodic_kwargs)
         else:
-            raise ValueError(
-                f"{ch.check_feature('comm')=} and {ch.check_feature('rel')=} cannot be handled by the analysis.")
+            raise ValueError(f"{comm=} and {rel=} cannot be handled by the analysis.")
 
     return result
 
 
+def _segment_chain(analysis, chain, seg):
+    """Argument of analysis for the segment seg (a sub-plan of the plan of chain): the plan itself for the analyses
+    of this module, otherwise the segment as CEChain (or ArrayCEChain), as the analyses got it before plans."""
+    if getattr(analysis, 'func', analysis) in _PLAN_ANALYSES or isinstance(chain, ChainPlan):
+        return seg
+    start, stop = seg.span
+    if isinstance(chain, ArrayCEChain):
+        return ArrayCEChain(chain.base_ts, chain.indices[start:stop])
+    return CEChain(*chain[start:stop], base_ts=chain.base_ts)
+
+
+@instrumented('_cut_chain', _cut_metrics)
 def _cut_chain(chain, communication=True, release=True):
-    """Cut cause-effect chain into homogeneous chains."""
-    new_chains = []
+    """Cut cause-effect chain into homogeneous chains (as plans)."""
+    plan = chain_plan(chain)
+    bounds = []
 
-    for idx, tsk in enumerate(chain):
+    for idx in range(len(plan)):
         if (
                 idx == 0 or
-                (communication and tsk.comm.type != curr_comm) or
-                (release and tsk.rel.type != curr_rel)
+                (communication and plan.comm_types[idx] != curr_comm) or
+                (release and plan.rel_types[idx] != curr_rel)
         ):
-            curr_comm = tsk.comm.type
-            curr_rel = tsk.rel.type
-            new_chains.append(CEChain(tsk, base_ts=chain.base_ts))
-        else:
-            new_chains[-1].append(tsk)
-    return new_chains
-
-
-def mix_improved(chain):
-    """Our analysis. Cut only when release constraint changes."""
-    cutted_chains = _cut_chain(chain, communication=False, release=True)
-
+            curr_comm = plan.comm_types[idx]
+            curr_rel = plan.rel_types[idx]
+            bounds.append(idx)
+    bounds.append(len(plan))
+    return [plan.segment(start, stop) for start, stop in zip(bounds[:-1], bounds[1:])]
+
+
+@instrumented('mix_improved', _length_metrics)
+def mix_improved(chain, engine='sweep', budget=None):
+    """Our analysis. Cut only when release constraint changes.
+    engine: engine of the periodic analyses, see _periodic().
+    budget: Budget of the periodic analyses (None: budget of this process, see set_budget())."""
+    plan = chain_plan(chain)
+    budget = budget if budget is not None else _budget
+    budget.start()
+    periodic_kwargs = _periodic_kwargs(engine, budget)
     result = 0
-    for ch in cutted_chains:
-        if ch.check_feature('rel') == 'sporadic':
-            result += mix_sporadic(ch)
-        elif ch.check_feature('rel') == 'periodic':
-            result += mix_periodic(ch)
+    for seg in plan.segments(communication=False, release=True):
+        rel = seg.rel_types[0]
+        if rel == 'sporadic':
+            result += mix_sporadic(seg)
+        elif rel == 'periodic':
+            result += mix_periodic(seg, **periodic_kwargs)
         else:
-            raise ValueError(f"{ch.check_feature('rel')=} cannot be handled by the analysis.")
+            raise ValueError(f"{rel=} cannot be handled by the analysis.")
     return result
 
 
+def _periodic_kwargs(engine, budget):
+    """Keyword arguments of the periodic analyses of mix() and mix_improved(): only those that differ from the
+    defaults, so that analyses without engine and budget (e.g., davare) can be used as well."""
+    kwargs = dict()
+    if engine != 'sweep':
+        kwargs['engine'] = engine
+    if budget.limited():
+        kwargs['budget'] = budget
+    return kwargs
+
+
 def mix_sporadic(chain):
     """Analysis for sporadic tasks and mixed communication means."""
-    assert all([tsk.comm.type in ['LET', 'implicit'] for tsk in chain])
+    plan = chain_plan(chain)
+    assert all([comm in ['LET', 'implicit'] for comm in plan.comm_types])
     result = 0
-    for idx in range(len(chain)):
-        result += chain[idx].rel.maxiat + _CX(idx, chain)
+    for idx in range(len(plan)):
+        result += plan.maxiats[idx] + _CX(idx, plan)
     return result
 
 
-def _CX(idx, chain):
+def _CX(idx, plan):
     """CX from our work."""
-    if chain[idx].comm.type == 'LET':
-        return chain[idx].dl.dl
-    elif (idx != len(chain) - 1 and
-          chain[idx + 1].comm.type == 'implicit' and
-          chain.base_ts.higher_prio(chain[idx], chain[idx + 1])):
-        return max(chain.base_ts.wcrts[chain[idx]] - chain[idx + 1].rel.maxiat, 0)
+    if plan.comm_types[idx] == 'LET':
+        return plan.dls[idx]
+    elif (idx != len(plan) - 1 and
+          plan.comm_types[idx + 1] == 'implicit' and
+          plan.prios[idx] < plan.prios[idx + 1]):
+        return max(plan.wcrts[idx] - plan.maxiats[idx + 1], 0)
     else:
-        return chain.base_ts.wcrts[chain[idx]]
+        return plan.wcrts[idx]
 
 
-def mix_periodic(chain):
+@instrumented('mix_periodic', _periodic_metrics)
+def mix_periodic(chain, engine='sweep', budget=None):
     """Analysis for periodic tasks and mixed communication means."""
-    # Compute chain hyperperiod and phase:
-    hyper = chain.hyperperiod()
-    max_phase = chain.max_phase()
-    WCRT_max = max(chain.base_ts.wcrts[tsk] for tsk in chain)
+    plan = chain_plan(chain)
+    offsets, tail = plan.offsets('mixed')
+    return _periodic(plan, offsets, tail, engine, budget)
+
+
+# Analyses that accept chain plans (see _segment_chain())
+_PLAN_ANALYSES = (davare, duerr, LET_spor, impl_per, LET_per, mix_sporadic, mix_periodic)
+
+
+def _add_to_compare_value_from_table(idx, plan):
+    """The compare value used in the periodic analysis to find the next job.
+    Please note: idx in range {0,1, ... , len(chain)-2}"""
+    this_comm = plan.comm_types[idx]
+    next_comm = plan.comm_types[idx + 1]
+
+    if this_comm == 'LET':
+        return plan.dls[idx]
+    elif this_comm == 'implicit' and next_comm == 'LET':
+        return plan.wcrts[idx]
+    elif this_comm == 'implicit' and next_comm == 'implicit':
+        if plan.prios[idx] < plan.prios[idx + 1]:
+            return 0
+        else:
+            return plan.wcrts[idx]
+    else:
+        raise ValueError(f"{this_comm=} and {next_comm=} cannot be handled by the analysis.")
+
+
+#####
+# Periodic engines
+#####
 
-    lengths = []
+# Results of periodic segments. The result only depends on the values of the segment tasks and the offsets, so the
+# same segment is shared by impl_per, LET_per and mix_periodic and by all chains and configurations it occurs in.
+_segment_cache = LRUCache(maxsize=2 ** 14)
+_segment_times = {'computed': 0.0, 'saved': 0.0}  # time spent in the engines / saved by cache hits
+_sweep_counts = {'sweeps': 0, 'early_exits': 0}  # sweeps and sweeps stopped at _periodic_bound()
+
+
+def set_segment_cache(maxsize):
+    """Replace the segment cache by an empty cache with at most maxsize entries (0: no caching)."""
+    global _segment_cache
+    _segment_cache = LRUCache(maxsize=maxsize)
+
+
+def segment_cache_stats(reset=False):
+    """Hits, misses and time (s) computed and saved by the segment cache of this process, and number of sweeps
+    and early exits of the sweeps (see _periodic_bound())
+    (reset: start counting again, e.g., to collect the statistics of a worker process chunk by chunk)."""
+    stats = {'hits': _segment_cache.hits, 'misses': _segment_cache.misses, **_segment_times, **_sweep_counts}
+    if reset:
+        _segment_cache.reset_stats()
+        _segment_times.update(computed=0.0, saved=0.0)
+        _sweep_counts.update(sweeps=0, early_exits=0)
+    return stats
+
+
+class Budget:
+    """Limit of the periodic analyses within one call of mix() or mix_improved().
+    Before a periodic segment is analyzed, the number of iterations of the engine is predicted (see
+    _predicted_iterations()) and the time since the start of the call is checked. If either exceeds the budget, the
+    segment gets the upper bound _periodic_bound() instead (which is at most the bound of the sporadic analyses),
+    and the result of the call is approximate.
+    iterations, seconds: None for no limit."""
+
+    def __init__(self, iterations=None, seconds=None):
+        if iterations is not None and iterations < 0:
+            raise ValueError(f'Non-negative iterations expected. Received {iterations=}.')
+        if seconds is not None and seconds < 0:
+            raise ValueError(f'Non-negative seconds expected. Received {seconds=}.')
+        self.iterations = iterations
+        self.seconds = seconds
+        self.approximate = False  # the current call used the upper bound for at least one segment
+        self.exceeded = 0  # calls that were approximate
+        self._start = 0.0
+
+    def limited(self):
+        """The budget limits the iterations or the time."""
+        return self.iterations is not None or self.seconds is not None
+
+    def start(self):
+        """Start the budget for a new call."""
+        self.approximate = False
+        self._start = time.perf_counter()
+
+    def allows(self, plan, engine):
+        """The periodic segment plan can be analyzed by the engine within the budget (otherwise, the current call is
+        approximate from now on)."""
+        if ((self.iterations is None or _predicted_iterations(plan, engine) <= self.iterations) and
+                (self.seconds is None or time.perf_counter() - self._start <= self.seconds)):
+            return True
+        if not self.approximate:
+            self.approximate = True
+            self.exceeded += 1
+        return False
+
+
+_budget = Budget()  # budget of mix() and mix_improved() in this process (default: no limit)
+
+
+def set_budget(iterations=None, seconds=None):
+    """Budget of mix() and mix_improved() in this process: at most 'iterations' iterations of the engine per periodic
+    segment and at most 'seconds' per call (None: no limit). Returns the Budget."""
+    global _budget
+    _budget = Budget(iterations, seconds)
+    return _budget
+
+
+def current_budget():
+    """Budget of this process, see set_budget()."""
+    return _budget
+
+
+def _periodic(plan, offsets, tail, engine, budget=None):
+    """Maximal length of the job chains of a periodic chain (given as plan).
+    offsets[idx] is added to the release of the job of task idx before the next job of task idx + 1 is searched
+    (Principle 2); tail is added to the release of the job of the last task (Principle 3).
+    engine: 'sweep' (job by job over the hyperperiod), 'classes' (only distinct phase classes)
+    or 'numpy' (sweep vectorized over all jobs of the first task).
+    budget: if the segment is not within the Budget, the upper bound _periodic_bound() is returned instead.
+    Results are cached per segment content, see _segment_cache."""
+    key = (engine, tuple(plan.periods), tuple(plan.phases), tuple(plan.wcrts), tuple(offsets), tail)
+    cached = _segment_cache.get(key)
+    if cached is not None:
+        result, duration = cached
+        _segment_times['saved'] += duration
+        instrument.record('_periodic', cache_hit=1, mvar=0)
+        return result
+
+    if budget is not None and not budget.allows(plan, engine):
+        instrument.record('budget_fallback', length=len(plan))
+        return _periodic_bound(plan, offsets, tail)
+
+    start = time.perf_counter()
+    result = _periodic_engine(plan, offsets, tail, engine)
+    duration = time.perf_counter() - start
+    _segment_times['computed'] += duration
+    _segment_cache.put(key, (result, duration))
+    if instrument.enabled():
+        mvar_first, mvar_last = _mvar_range(plan)
+        instrument.record('_periodic', cache_hit=0, mvar=mvar_last - mvar_first + 1, time=duration)
+    return result
+
+
+def _periodic_engine(plan, offsets, tail, engine):
+    """Result of _periodic() computed by the engine."""
+    if engine == 'sweep':
+        return _periodic_sweep(plan, offsets, tail)
+    elif engine == 'classes':
+        return _periodic_classes(plan, offsets, tail)
+    elif engine == 'numpy':
+        return _periodic_numpy(plan, offsets, tail)
+    else:
+        raise ValueError(f'{engine=} is not in (\'sweep\', \'classes\', \'numpy\').')
+
+
+def _periodic_sweep(plan, offsets, tail):
+    """Construct the job chain for each job of the first task until the hyperperiod is covered."""
+    periods, phases = plan.periods, plan.phases
+
+    # Compute chain hyperperiod and phase and maximum wcrt:
+    hyper = plan.hyperperiod()
+    max_phase = plan.max_phase()
+    WCRT_max = max(plan.wcrts)
+
+    # No job chain is longer than the bound, so the sweep can stop once it is reached
+    bound = _periodic_bound(plan, offsets, tail)
+    result = None
+    iterations = 0
 
     for mvar in itertools.count(start=1):
         # Principle 1 and chain definition
-        zvar = _release(mvar, chain[0])
-        relvar = _release(mvar + 1, chain[0])
+        zvar = _release(mvar, periods[0], phases[0])
+        relvar = _release(mvar + 1, periods[0], phases[0])
 
         # check conditions
-        if relvar + chain.base_ts.wcrts[chain[0]] < max_phase:
+        if relvar + plan.wcrts[0] < max_phase:
             continue
         if zvar > max_phase + hyper + WCRT_max:
             break
 
-        for idx, (this_tsk, next_tsk) in enumerate(zip(chain[:-1], chain[1:])):
+        for idx in range(1, len(plan)):
             # Principle 2 (Compute release of next job in the job chain)
-            compare_value = relvar + _add_to_compare_value_from_table(idx, chain)
-            relvar = _release_after(compare_value, next_tsk)
+            relvar = _release_after(relvar + offsets[idx - 1], periods[idx], phases[idx])
 
         # Principle 3
-        if chain[-1].comm.type == 'LET':
-            zprimevar = relvar + chain[-1].dl.dl
-        elif chain[-1].comm.type == 'implicit':
-            zprimevar = relvar + chain.base_ts.wcrts[chain[-1]]
+        zprimevar = relvar + tail
 
-        lengths.append(zprimevar - zvar)
+        iterations += 1
+        if result is None or zprimevar - zvar > result:
+            result = zprimevar - zvar
+            if result >= bound:
+                break
 
-    return max(lengths)
+    _count_sweep(result >= bound, iterations)
+    return result
 
 
-def _add_to_compare_value_from_table(idx, chain):
-    """The compare value used in the periodic analysis to find the next job.
-    Please note: idx in range {0,1, ... , len(chain)-2}"""
-    this_tsk = chain[idx]
-    next_tsk = chain[idx + 1]
-
-    if this_tsk.comm.type == 'LET':
-        return this_tsk.dl.dl
-    elif this_tsk.comm.type == 'implicit' and next_tsk.comm.type == 'LET':
-        return chain.base_ts.wcrts[this_tsk]
-    elif this_tsk.comm.type == 'implicit' and next_tsk.comm.type == 'implicit':
-        if chain.base_ts.higher_prio(this_tsk, next_tsk):
-            return 0
+def _periodic_numpy(plan, offsets, tail, chunk=2 ** 20):
+    """Same result as _periodic_sweep(), but all jobs of the first task are pushed through the chain at once as int64
+    array (in chunks of at most 'chunk' jobs). Falls back to _periodic_sweep() if the values are no integers or if
+    they could overflow int64."""
+    periods, phases, wcrts = plan.periods, plan.phases, plan.wcrts
+
+    values = periods + phases + wcrts + list(offsets) + [tail]
+    if not all(isinstance(val, (int, np.integer)) for val in values):
+        return _periodic_sweep(plan, offsets, tail)
+
+    # Range of mvar of the sweep (Principle 1 and check conditions)
+    mvar_first, mvar_last = _mvar_range(plan)
+
+    # Largest value that can occur in the arrays
+    largest = phases[0] + (mvar_last + 1) * periods[0] + sum(abs(val) for val in offsets) + sum(periods) + abs(tail)
+    if largest >= 2 ** 62:
+        return _periodic_sweep(plan, offsets, tail)
+
+    bound = _periodic_bound(plan, offsets, tail)
+    result = None
+    iterations = 0
+    for mvar_start in range(mvar_first, mvar_last + 1, chunk):
+        mvar = np.arange(mvar_start, min(mvar_start + chunk, mvar_last + 1), dtype=np.int64)
+        zvar = phases[0] + (mvar - 1) * periods[0]
+        relvar = zvar + periods[0]
+
+        for idx in range(1, len(plan)):
+            # Principle 2 (exact ceil-division of _release_after)
+            relvar = phases[idx] - ((phases[idx] - relvar - offsets[idx - 1]) // periods[idx]) * periods[idx]
+
+        # Principle 3
+        length = int((relvar - zvar).max()) + tail
+        iterations += len(mvar)
+        if result is None or length > result:
+            result = length
+            if result >= bound:
+                break
+
+    _count_sweep(result >= bound, iterations)
+    return result
+
+
+def _periodic_bound(plan, offsets, tail):
+    """Upper bound on the length of every job chain of _periodic_sweep(), in closed form.
+    The job of task idx + 1 is released at least offsets[idx] and less than offsets[idx] + period of task idx + 1
+    after the job of task idx (Principle 2), and the distance of both releases is congruent to the difference of
+    the phases modulo g = gcd of both periods. Hence, (for integer values) it is at most
+    offsets[idx] + period - g + ((phase difference - offsets[idx]) mod g). The bound is reached whenever these
+    maxima occur in the same job chain."""
+    periods, phases = plan.periods, plan.phases
+    bound = periods[0] + tail  # Principle 1 and 3
+    for idx in range(len(plan) - 1):
+        period, offset = periods[idx + 1], offsets[idx]
+        if all(isinstance(val, (int, np.integer)) for val in (periods[idx], period, phases[idx], phases[idx + 1],
+                                                               offset)):
+            gcd = math.gcd(periods[idx], period)
+            bound += offset + period - gcd + (phases[idx + 1] - phases[idx] - offset) % gcd
         else:
-            return chain.base_ts.wcrts[this_tsk]
-    else:
-        raise ValueError(f"{this_tsk.comm.type=} and {next_tsk.comm.type=} cannot be handled by the analysis.")
+            bound += offset + period
+    return bound
+
+
+def _count_sweep(early_exit, iterations):
+    """Count a sweep (see segment_cache_stats() and instrument.py)."""
+    _sweep_counts['sweeps'] += 1
+    _sweep_counts['early_exits'] += early_exit
+    instrument.record('_periodic_sweep', early_exit=int(early_exit), iterations=iterations)
+
+
+def _mvar_range(plan):
+    """First and last mvar for which _periodic_sweep() constructs a job chain (Principle 1 and check conditions)."""
+    periods, phases, wcrts = plan.periods, plan.phases, plan.wcrts
+    max_phase = max(phases)
+    mvar_first = max(1, -((phases[0] + wcrts[0] - max_phase) // periods[0]))
+    mvar_last = (max_phase + plan.hyperperiod() + max(wcrts) - phases[0]) // periods[0] + 1
+    return mvar_first, mvar_last
+
+
+def _predicted_iterations(plan, engine):
+    """Number of job chains (sweep, numpy) or phase classes (classes) the engine constructs for the segment plan,
+    without early exits (see _periodic_bound())."""
+    if engine == 'classes':
+        suffix_lcm = math.lcm(*plan.periods[1:])
+        return suffix_lcm // math.gcd(plan.periods[0], suffix_lcm)
+    mvar_first, mvar_last = _mvar_range(plan)
+    return max(mvar_last - mvar_first + 1, 0)
+
+
+def _periodic_classes(plan, offsets, tail):
+    """Same result as _periodic_sweep() without iterating over the hyperperiod.
+
+    The length of the job chain that starts with the m-th job of the first task is periodic in m with period
+    hyperperiod/period of the first task, and the sweep covers at least one such period. After the job of task idx
+    is found, the rest of the job chain only depends on its release modulo the lcm of the periods of the remaining
+    tasks. Hence, only these phase classes are propagated, keeping the longest prefix of each class."""
+    periods, phases = plan.periods, plan.phases
+
+    # lcm of the periods of the tasks after task idx
+    suffix_lcm = [1] * len(plan)
+    for idx in range(len(plan) - 2, -1, -1):
+        suffix_lcm[idx] = math.lcm(suffix_lcm[idx + 1], periods[idx + 1])
+
+    # Principle 1: release of the second job of the first task (the prefix has length of its period)
+    step = math.gcd(periods[0], suffix_lcm[0])
+    classes = dict.fromkeys(range(phases[0] % step, suffix_lcm[0], step), periods[0])
+
+    for idx in range(len(plan) - 1):
+        # Principle 2 for each phase class
+        period, phase, offset, modulus = periods[idx + 1], phases[idx + 1], offsets[idx], suffix_lcm[idx + 1]
+        next_classes = dict()
+        for relvar, prefix in classes.items():
+            next_relvar = phase - ((phase - relvar - offset) // period) * period
+            key = next_relvar % modulus
+            prefix += next_relvar - relvar
+            if next_classes.get(key, prefix) <= prefix:
+                next_classes[key] = prefix
+        classes = next_classes
+
+    # Principle 3
+    return max(classes.values()) + tail
 
 
 #####
 # Help functions
 #####
 
-def _release_after(time, tsk):
-    """Next release of tsk at or after 'time' for periodic tasks."""
-    return tsk.rel.phase + math.ceil((time - tsk.rel.phase) / tsk.rel.period) * tsk.rel.period
+def _release_after(time, period, phase):
+    """Next release at or after 'time' for periodic tasks (exact ceil-division, also for large integers)."""
+    return phase - ((phase - time) // period) * period
 
 
-def _release(m, tsk):
+def _release(m, period, phase):
     """Time of the m-th job release of a periodic task.
     (First job is at m=1.)"""
-    return tsk.rel.phase + (m - 1) * tsk.rel.period
+    return phase + (m - 1) * period
 
 
 if __name__ == "__main__":
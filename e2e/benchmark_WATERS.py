@@ -7,8 +7,8 @@ import numpy as np
 import random
 from scipy.stats import exponweib
 from collections import Counter
-from tasks.task import Task
-from tasks.taskset import TaskSet
+from tasks.task import Task, check_tasks
+from tasks.taskset import TaskSet, transform, compute_wcrts_batch
 from cechains.chain import CEChain
 
 
@@ -29,171 +29,70 @@ class task(dict):
 
 
 def task_transormation(tsk):
-    """Transform task for creation to our task model for analysis."""
-    return Task(release='periodic', period=tsk['period'],
+    """Transform task for creation to our task model for analysis (checked by gen_taskset())."""
+    return Task.from_values(release='periodic', period=tsk['period'],
                 execution='wcet', wcet=tsk['execution'],
                 deadline='implicit')  # make implicit
 
 
+# Parameters from WATERS 'Real World Automotive Benchmarks For Free' per period:
+# - scaling: range of the factor to make WCET out of ACET (fmin, fmax)
+# - weibull: shape and scale of the weibull distribution of the ACET
+# - bounds: range of the ACET, samples outside are pulled again
+# - uniform: range of the ACET if it is not weibull distributed
+RUNNABLE_ACET = {
+    1: dict(scaling=(1.3, 29.11), weibull=(1.044, 1.0 / 0.214), bounds=(0.34, 30.11)),
+    2: dict(scaling=(1.54, 19.04), weibull=(1.0607440083, 1.0 / 0.2479463059), bounds=(0.32, 40.69)),
+    5: dict(scaling=(1.13, 18.44), weibull=(1.00818633, 1.0 / 0.09), bounds=(0.36, 83.38)),
+    10: dict(scaling=(1.06, 30.03), weibull=(1.0098, 1.0 / 0.0985), bounds=(0.21, 309.87)),
+    20: dict(scaling=(1.06, 15.61), weibull=(1.01309699673984310, 1.0 / 0.1138186679), bounds=(0.25, 291.42)),
+    50: dict(scaling=(1.13, 7.76), weibull=(1.00324219159296302, 1.0 / 0.05685450460), bounds=(0.29, 92.98)),
+    100: dict(scaling=(1.02, 8.88), weibull=(1.00900736028318527, 1.0 / 0.09448019812), bounds=(0.21, 420.43)),
+    200: dict(scaling=(1.03, 4.9), weibull=(1.15710612360723798, 1.0 / 0.3706045664), bounds=(0.22, 21.95)),
+    # No weibull since the range from 0.37 to 0.46 is too short to be modeled by weibull properly.
+    1000: dict(scaling=(1.84, 4.75), uniform=(0.37, 0.46)),
+}
+
+_weibull_dists = dict()  # period -> frozen distribution
+
+
+def _weibull_dist(period):
+    """Frozen weibull distribution of the ACET of runnables with the period (created once)."""
+    if period not in _weibull_dists:
+        shape, scale = RUNNABLE_ACET[period]['weibull']
+        _weibull_dists[period] = exponweib(1, shape, loc=0, scale=scale)
+    return _weibull_dists[period]
+
+
 def sample_runnable_acet(period, amount=1, scalingFlag=False):
     """Create runnables according to the WATERS benchmark.
     scalingFlag: make WCET out of ACET with scaling
     """
-    # Parameters from WATERS 'Real World Automotive Benchmarks For Free'
-    if period == 1:
-        # Pull scaling factor.
-        scaling = np.random.uniform(1.3, 29.11, amount)  # between fmin fmax
+    if period not in RUNNABLE_ACET:
+        raise ValueError(f'{period=} is not in {list(RUNNABLE_ACET)}.')
+    params = RUNNABLE_ACET[period]
+
+    # Pull scaling factor.
+    scaling = np.random.uniform(*params['scaling'], amount)
+
+    if 'uniform' in params:
+        samples = np.random.uniform(*params['uniform'], amount)
+    else:
         # Pull samples with weibull distribution.
-        dist = exponweib(1, 1.044, loc=0, scale=1.0 / 0.214)
-        samples = dist.rvs(size=amount)
-        while True:
-            outliers_detected = False
-            for i in range(len(samples)):
-                # Check if they are in the range.
-                if samples[i] < 0.34 or samples[i] > 30.11:
-                    outliers_detected = True
-                    samples[i] = dist.rvs(size=1)
-            # Case: Some samples had to be pulled again.
-            if outliers_detected:
-                continue
-            # Case: All samples are in the range.
-            if scalingFlag:  # scaling
-                return list(0.001 * samples * scaling)
-            else:
-                return list(0.001 * samples)
-
-    # In the following same structure but different values.
-
-    if period == 2:
-        scaling = np.random.uniform(1.54, 19.04, amount)
-        dist = exponweib(1, 1.0607440083, loc=0, scale=1.0 / 0.2479463059)
-        samples = dist.rvs(size=amount)
-        while True:
-            outliers_detected = False
-            for i in range(len(samples)):
-                if samples[i] < 0.32 or samples[i] > 40.69:
-                    outliers_detected = True
-                    samples[i] = dist.rvs(size=1)
-            if outliers_detected:
-                continue
-            if scalingFlag:
-                return list(0.001 * samples * scaling)
-            else:
-                return list(0.001 * samples)
-
-    if period == 5:
-        scaling = np.random.uniform(1.13, 18.44, amount)
-        dist = exponweib(1, 1.00818633, loc=0, scale=1.0 / 0.09)
-        samples = dist.rvs(size=amount)
-        while True:
-            outliers_detected = False
-            for i in range(len(samples)):
-                if samples[i] < 0.36 or samples[i] > 83.38:
-                    outliers_detected = True
-                    samples[i] = dist.rvs(size=1)
-            if outliers_detected:
-                continue
-            if scalingFlag:
-                return list(0.001 * samples * scaling)
-            else:
-                return list(0.001 * samples)
-
-    if period == 10:
-        scaling = np.random.uniform(1.06, 30.03, amount)
-        dist = exponweib(1, 1.0098, loc=0, scale=1.0 / 0.0985)
+        dist = _weibull_dist(period)
         samples = dist.rvs(size=amount)
-        while True:
-            outliers_detected = False
-            for i in range(len(samples)):
-                if samples[i] < 0.21 or samples[i] > 309.87:
-                    outliers_detected = True
-                    samples[i] = dist.rvs(size=1)
-            if outliers_detected:
-                continue
-            if scalingFlag:
-                return list(0.001 * samples * scaling)
-            else:
-                return list(0.001 * samples)
-
-    if period == 20:
-        scaling = np.random.uniform(1.06, 15.61, amount)
-        dist = exponweib(1, 1.01309699673984310, loc=0, scale=1.0 / 0.1138186679)
-        samples = dist.rvs(size=amount)
-        while True:
-            outliers_detected = False
-            for i in range(len(samples)):
-                if samples[i] < 0.25 or samples[i] > 291.42:
-                    outliers_detected = True
-                    samples[i] = dist.rvs(size=1)
-            if outliers_detected:
-                continue
-            if scalingFlag:
-                return list(0.001 * samples * scaling)
-            else:
-                return list(0.001 * samples)
-
-    if period == 50:
-        scaling = np.random.uniform(1.13, 7.76, amount)
-        dist = exponweib(1, 1.00324219159296302, loc=0,
-                         scale=1.0 / 0.05685450460)
-        samples = dist.rvs(size=amount)
-        while True:
-            outliers_detected = False
-            for i in range(len(samples)):
-                if samples[i] < 0.29 or samples[i] > 92.98:
-                    outliers_detected = True
-                    samples[i] = dist.rvs(size=1)
-            if outliers_detected:
-                continue
-            if scalingFlag:
-                return list(0.001 * samples * scaling)
-            else:
-                return list(0.001 * samples)
-
-    if period == 100:
-        scaling = np.random.uniform(1.02, 8.88, amount)
-        dist = exponweib(1, 1.00900736028318527, loc=0,
-                         scale=1.0 / 0.09448019812)
-        samples = dist.rvs(size=amount)
-        while True:
-            outliers_detected = False
-            for i in range(len(samples)):
-                if samples[i] < 0.21 or samples[i] > 420.43:
-                    outliers_detected = True
-                    samples[i] = dist.rvs(size=1)
-            if outliers_detected:
-                continue
-            if scalingFlag:
-                return list(0.001 * samples * scaling)
-            else:
-                return list(0.001 * samples)
-
-    if period == 200:
-        scaling = np.random.uniform(1.03, 4.9, amount)
-        dist = exponweib(1, 1.15710612360723798, loc=0,
-                         scale=1.0 / 0.3706045664)
-        samples = dist.rvs(size=amount)
-        while True:
-            outliers_detected = False
-            for i in range(len(samples)):
-                if samples[i] < 0.22 or samples[i] > 21.95:
-                    outliers_detected = True
-                    samples[i] = dist.rvs(size=1)
-            if outliers_detected:
-                continue
-            if scalingFlag:
-                return list(0.001 * samples * scaling)
-            else:
-                return list(0.001 * samples)
-
-    if period == 1000:
-        # No weibull since the range from 0.37 to 0.46 is too short to be
-        # modeled by weibull properly.
-        scaling = np.random.uniform(1.84, 4.75, amount)
-        if scalingFlag:
-            return list(0.001 * np.random.uniform(0.37, 0.46, amount) * scaling)
-        else:
-            return list(0.001 * np.random.uniform(0.37, 0.46, amount))
+        # Pull samples that are not in the range again (all at once, in the order of their position,
+        # which draws the same random numbers as pulling them one after the other).
+        low, high = params['bounds']
+        outliers = (samples < low) | (samples > high)
+        while outliers.any():
+            samples[outliers] = dist.rvs(size=int(outliers.sum()))
+            outliers = (samples < low) | (samples > high)
+
+    if scalingFlag:  # scaling
+        return list(0.001 * samples * scaling)
+    else:
+        return list(0.001 * samples)
 
 
 def gen_taskset(
@@ -201,7 +100,8 @@ def gen_taskset(
         period_pdf=[0.03 / 0.85, 0.02 / 0.85, 0.02 / 0.85, 0.25 / 0.85, 0.25 / 0.85, 0.03 / 0.85, 0.2 / 0.85,
                     0.01 / 0.85, 0.04 / 0.85],
         scaling_flag=True,
-        threshold=0.01):
+        threshold=0.01,
+        lazy=True):
     """Main function to generate a task set with the WATERS benchmark.
     Output: tasksets as given in tasks.taskset.TaskSet
     with tasks as tasks.task.Task
@@ -213,6 +113,8 @@ def gen_taskset(
     period_pdf: statistical distribution
     scalingFlag: make WCET out of ACET with scaling
     threshold: accuracy of the targeted utilization
+    lazy: draw runnables only when needed (otherwise all runnables are created and shuffled first,
+        which reproduces the task sets of earlier versions for the same seed)
     """
 
     periods = [1, 2, 5, 10, 20, 50, 100, 200, 1000]
@@ -221,24 +123,11 @@ def gen_taskset(
     dist = stats.rv_discrete(name='periods',
                              values=(periods, period_pdf))
     runnables = 30000  # number of runnables
-    sys_runnable_periods = dist.rvs(size=runnables)  # list all periods
 
-    # Count runnables.
-    amount_sys_runnables = dict(Counter(sys_runnable_periods))
-    assert sum(amount_sys_runnables.values()) == runnables
-
-    # Build tasks from runnables.
-    taskset = []
-    for per in periods:
-        # Random WCETs.
-        wcets = sample_runnable_acet(per, amount_sys_runnables[per], scaling_flag)
-        # Create Tasks.
-        assert len(wcets) == amount_sys_runnables[per]
-        for wcet in wcets:
-            taskset.append(task(wcet, per, per))
-
-    # Shuffle the task set.
-    random.shuffle(taskset)
+    if lazy:
+        runnable_pool = _lazy_runnables(dist, runnables, scaling_flag)
+    else:
+        runnable_pool = _all_runnables(dist, runnables, scaling_flag, periods)
 
     # Select subset of tasks using the subset-sum approximation algorithm.
     util = 0.0
@@ -246,9 +135,9 @@ def gen_taskset(
     this_taskset = []
     while True:
         if util < util_target:  # add a task
-            if len(taskset) == 0:
+            new_tsk = next(runnable_pool, None)
+            if new_tsk is None:
                 raise ValueError('Under this setting the targeted utilization of {util_target=} cannot be reached.')
-            new_tsk = taskset.pop()
             this_taskset.append(new_tsk)
             util += new_tsk['execution'] / new_tsk['period']
         elif util > util_target + threshold:  # remove a task
@@ -259,22 +148,108 @@ def gen_taskset(
 
     # Transform to our taskset model
     this_taskset = TaskSet(*[task_transormation(tsk) for tsk in this_taskset])
+    check_tasks(this_taskset)
 
     return this_taskset
 
 
+def _all_runnables(dist, runnables, scaling_flag, periods):
+    """Create all runnables, shuffle them, and return them one after the other (from the back).
+    Help function for gen_taskset()."""
+    sys_runnable_periods = dist.rvs(size=runnables)  # list all periods
+
+    # Count runnables.
+    amount_sys_runnables = dict(Counter(sys_runnable_periods))
+    assert sum(amount_sys_runnables.values()) == runnables
+
+    # Build tasks from runnables.
+    taskset = []
+    for per in periods:
+        # Random WCETs.
+        wcets = sample_runnable_acet(per, amount_sys_runnables[per], scaling_flag)
+        # Create Tasks.
+        assert len(wcets) == amount_sys_runnables[per]
+        for wcet in wcets:
+            taskset.append(task(wcet, per, per))
+
+    # Shuffle the task set.
+    random.shuffle(taskset)
+
+    return reversed(taskset)
+
+
+def _lazy_runnables(dist, runnables, scaling_flag, block=32, max_block=4096):
+    """Draw at most 'runnables' runnables on demand, in blocks of growing size.
+    Periods are drawn from dist and WCETs from sample_runnable_acet(), independently for each runnable, which
+    has the same distribution as taking runnables from the shuffled pool of all runnables.
+    Help function for gen_taskset()."""
+    drawn = 0
+    while drawn < runnables:
+        size = min(block, runnables - drawn)
+        block_periods = dist.rvs(size=size)
+
+        # Random WCETs (for each period at once).
+        block_wcets = np.empty(size)
+        for per in sorted(set(block_periods.tolist())):
+            positions = block_periods == per
+            block_wcets[positions] = sample_runnable_acet(per, int(positions.sum()), scaling_flag)
+
+        for per, wcet in zip(block_periods.tolist(), block_wcets.tolist()):
+            yield task(wcet, per, per)
+
+        drawn += size
+        block = min(2 * block, max_block)
+
+
+def gen_tasksets_chains(util_target, seeds, timebase=None, **kwargs):
+    """Task sets and cause-effect chains for the evaluation, one for each seed (numpy.random.SeedSequence).
+    Each task set is ordered by deadline, gets random phases and implicit communication, is transformed
+    (with the time base tolerance timebase, see tasks.taskset.transform()), and its wcrts are computed.
+    kwargs are passed to gen_taskset().
+    Output: list of (task set, cause-effect chains) with None for task sets with wcrt > dl or without chains.
+    The result for a seed does not depend on the other seeds."""
+    ts_ces = []
+    for seed in seeds:
+        np.random.seed(seed.generate_state(4))
+        random.seed(int(seed.generate_state(1, np.uint64)[0]))
+
+        ts = gen_taskset(util_target, **kwargs)
+        ts.sort_dm()
+        for tsk in ts:
+            # Draw random phase
+            tsk.rel.phase = random.random() * tsk.rel.period
+            # Make implicit communication
+            tsk.add_feature('communication', 'implicit')
+        transform(ts, timebase=timebase)
+        ts_ces.append((ts, gen_ce_chains(ts)))
+
+    # TDA (all task sets at once)
+    compute_wcrts_batch([ts for ts, _ in ts_ces])
+
+    return [(ts, ces) if len(ces) != 0 and all(tsk.dl.dl >= ts.wcrts[tsk] for tsk in ts) else None
+            for ts, ces in ts_ces]
+
+
 ###
 # Cause-effect chain generation.
 ###
 
-def gen_ce_chains(task_set):  # TODO update
+def gen_ce_chains(task_set, batched=True):  # TODO update
     """Generate CE chains based on task sets as object of tasks.taskset.TaskSet.
-    Each task is object of tasks.task.Task."""
+    Each task is object of tasks.task.Task.
+    batched: draw the shapes of all chains at once (otherwise one draw per chain and activation pattern,
+        which reproduces the chains of earlier versions for the same seed)"""
     distribution_involved_activation_patterns = stats.rv_discrete(
         values=([1, 2, 3], [0.7, 0.2, 0.1]))
     distribution_number_of_tasks = stats.rv_discrete(
         values=([2, 3, 4, 5], [0.3, 0.4, 0.2, 0.1]))
+
+    if batched:
+        return _gen_ce_chains_batched(task_set, distribution_involved_activation_patterns,
+                                      distribution_number_of_tasks)
+
     ce_chains = []
+    tasks_by_period = task_set.tasks_by_period()
 
     # Determine different periods of the tasks set.
     activation_patterns = list(set(map(
@@ -297,8 +272,7 @@ def gen_ce_chains(task_set):  # TODO update
         # Tasks ordered from that specific activation pattern.
         period_filtered_task_set = []
         for period in involved_activation_patterns:
-            period_filtered_task_set.append(
-                [tsk for tsk in task_set if tsk.rel.period == period])
+            period_filtered_task_set.append(tasks_by_period[period])
 
         try:
             for filt_task_set in period_filtered_task_set:
@@ -325,6 +299,47 @@ def gen_ce_chains(task_set):  # TODO update
     return ce_chains
 
 
+def _gen_ce_chains_batched(task_set, distribution_involved_activation_patterns, distribution_number_of_tasks):
+    """Same as gen_ce_chains(), but the number of activation patterns of all chains and the number of tasks
+    of all activation patterns are drawn in one call each.
+    Help function for gen_ce_chains()."""
+    tasks_by_period = task_set.tasks_by_period()
+    activation_patterns = list(tasks_by_period)
+
+    # there need to be at least 3 activation patterns, otherwise no chain for the taskset is created
+    if len(activation_patterns) < 3:
+        return []
+
+    # Shapes of 30 to 60 cause-effect chains
+    number_of_chains = int(np.random.randint(30, 60))
+    numbers_of_patterns = distribution_involved_activation_patterns.rvs(size=number_of_chains)
+    numbers_of_tasks = distribution_number_of_tasks.rvs(size=int(numbers_of_patterns.sum())).tolist()
+
+    ce_chains = []
+    for number_of_patterns in numbers_of_patterns.tolist():
+        # Activation patterns of the cause-effect chain and 2-5 tasks for each of them.
+        involved_activation_patterns = np.random.choice(len(activation_patterns), size=number_of_patterns,
+                                                        replace=False)
+        sizes, numbers_of_tasks = numbers_of_tasks[:number_of_patterns], numbers_of_tasks[number_of_patterns:]
+
+        # If there are not enough tasks with that period, the chain is skipped
+        filt_task_sets = [tasks_by_period[activation_patterns[idx]] for idx in involved_activation_patterns]
+        if any(size > len(filt_task_set) for size, filt_task_set in zip(sizes, filt_task_sets)):
+            continue
+
+        tasks_in_chain = []
+        for size, filt_task_set in zip(sizes, filt_task_sets):
+            tasks_in_chain.extend(filt_task_set[idx] for idx in np.random.choice(len(filt_task_set), size=size,
+                                                                                 replace=False))
+
+        # Randomize order of the tasks in the chain.
+        np.random.shuffle(tasks_in_chain)
+
+        ce_chains.append(CEChain(*tasks_in_chain, base_ts=task_set))
+
+    return ce_chains
+
+
 if __name__ == '__main__':
     """Debug."""
     ts_set = [gen_taskset(0.5) for _ in range(5)]
@@ -0,0 +1,103 @@
+"""Content-addressed caches for analysis results.
+LRUCache keeps a bounded number of entries in memory (least recently used are evicted) and, optionally, all entries
+in a persistent shelve file. map_cached() answers the items of a stream from the cache and computes the others.
+"""
+from collections import OrderedDict, deque
+import hashlib
+import shelve
+
+_MISS = object()
+
+
+class LRUCache:
+    """Cache with at most maxsize entries in memory and an optional persistent layer (shelve file at path).
+    Keys can be any tuple of str, int, float and tuples thereof; the persistent layer stores them by content hash."""
+
+    def __init__(self, maxsize=2 ** 16, path=None):
+        if maxsize < 0:
+            raise ValueError(f'Non-negative maxsize expected. Received {maxsize=}.')
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._shelf = shelve.open(path) if path is not None else None
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def digest(key):
+        """Content hash of a key (key of the persistent layer)."""
+        return hashlib.blake2b(repr(key).encode(), digest_size=16).hexdigest()
+
+    def get(self, key, default=None):
+        """Cached value of key (and count a hit), otherwise default (and count a miss)."""
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return self._entries[key]
+        if self._shelf is not None:
+            value = self._shelf.get(self.digest(key), _MISS)
+            if value is not _MISS:
+                self._remember(key, value)
+                self.hits += 1
+                return value
+        self.misses += 1
+        return default
+
+    def put(self, key, value):
+        """Cache value for key (in memory and in the persistent layer)."""
+        self._remember(key, value)
+        if self._shelf is not None:
+            self._shelf[self.digest(key)] = value
+
+    def _remember(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        """Hit and miss counters."""
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / lookups if lookups else 0.0,
+                'size': len(self._entries)}
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """Write the persistent layer to disk."""
+        if self._shelf is not None:
+            self._shelf.close()
+            self._shelf = None
+
+
+def map_cached(cache, compute, items, key):
+    """Results for all items (in order): from the cache for cached key(item), otherwise from compute.
+    compute maps an iterable of items to their results in order (e.g., helpers.imap_bounded with a pool);
+    it only receives the items that are not cached. Computed results are added to the cache."""
+    order = deque()  # (key, cached result or _MISS) of the items taken from items, not yet returned
+
+    def misses():
+        for item in items:
+            item_key = key(item)
+            order.append((item_key, cache.get(item_key, _MISS)))
+            if order[-1][1] is _MISS:
+                yield item
+
+    for result in compute(misses()):
+        while order[0][1] is not _MISS:
+            yield order.popleft()[1]
+        item_key, _ = order.popleft()
+        cache.put(item_key, result)
+        yield result
+    while order:
+        yield order.popleft()[1]
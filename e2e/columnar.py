@@ -0,0 +1,265 @@
+"""Columnar on-disk format of the step outputs.
+A data set is a directory with one .npy file per column and a meta.json. Columns are appended to on disk while they
+are produced, meta.json is written last. Loading memory-maps the columns, so only the columns (and parts of columns)
+that are used are read from disk.
+
+- Step 1: task columns of all task sets (see tasks.arraytaskset.ArrayTaskSet, including the wcrts), the first
+  task and the time base of each task set (ts_start, ts_tick), and the chains as lists of task indices
+  (chain_ts, chain_start, chain_tasks).
+- Step 2: one result vector (shard) per (spor, let, analysis), written as soon as it is complete, and an index.
+"""
+import hashlib
+import json
+import os
+import numpy as np
+from tasks.arraytaskset import ArrayTaskSet, ArrayCEChain
+
+TASK_COLUMNS = ArrayTaskSet.value_columns + ArrayTaskSet.type_columns
+
+
+_HEADER_SIZE = 128  # bytes of the .npy header of appended columns (room for any length)
+
+
+def _npy_header(dtype, length):
+    """.npy header (version 1.0) of a one-dimensional array, padded to _HEADER_SIZE bytes."""
+    header = repr({'descr': np.lib.format.dtype_to_descr(dtype), 'fortran_order': False, 'shape': (length,)})
+    header = header.ljust(_HEADER_SIZE - 11) + '\n'
+    return b'\x93NUMPY\x01\x00' + len(header).to_bytes(2, 'little') + header.encode('latin1')
+
+
+class _ColumnWriter:
+    """One-dimensional .npy file that values are appended to; the header is updated with each append.
+    dtype: None for the dtype of the first values (int64 if there are none);
+    later values of another kind (e.g., float after int) promote the column as np.concatenate would."""
+
+    def __init__(self, filename, dtype=None):
+        self.filename = filename
+        self.dtype = np.dtype(dtype) if dtype is not None else None
+        self.length = 0
+        self._file = None
+
+    def append(self, values):
+        values = np.asarray(values)
+        if self.dtype is None:
+            self.dtype = values.dtype
+        elif np.result_type(self.dtype, values.dtype) != self.dtype:
+            self._convert(np.result_type(self.dtype, values.dtype))
+        if self._file is None:
+            self._file = open(self.filename, 'wb+')
+            self._file.write(_npy_header(self.dtype, 0))
+        self._file.seek(0, os.SEEK_END)
+        self._file.write(np.ascontiguousarray(values, dtype=self.dtype).tobytes())
+        self.length += len(values)
+        self._file.seek(0)
+        self._file.write(_npy_header(self.dtype, self.length))
+
+    def _convert(self, dtype, chunk=2 ** 20):
+        """Rewrite the values written so far with dtype."""
+        self._file.close()
+        old = np.load(self.filename, mmap_mode='r')
+        with open(self.filename + '.tmp', 'wb') as file:
+            file.write(_npy_header(dtype, self.length))
+            for start in range(0, self.length, chunk):
+                file.write(np.ascontiguousarray(old[start:start + chunk], dtype=dtype).tobytes())
+        del old
+        os.replace(self.filename + '.tmp', self.filename)
+        self._file = open(self.filename, 'rb+')
+        self.dtype = dtype
+
+    def close(self):
+        if self._file is None:
+            self.dtype = self.dtype if self.dtype is not None else np.dtype(np.int64)
+            self.append(np.zeros(0, dtype=self.dtype))
+        self._file.close()
+
+
+def _load_column(dirname, col):
+    return np.load(os.path.join(dirname, f'{col}.npy'), mmap_mode='r')
+
+
+def _digest(columns):
+    """Content hash of columns."""
+    digest = hashlib.blake2b(digest_size=16)
+    for col in sorted(columns):
+        digest.update(col.encode())
+        digest.update(str(columns[col].dtype).encode())
+        digest.update(np.ascontiguousarray(columns[col]).data)  # memory-mapped columns are not copied
+    return digest.hexdigest()
+
+
+def _load_meta(dirname):
+    with open(os.path.join(dirname, 'meta.json')) as file:
+        return json.load(file)
+
+
+def exists(dirname):
+    """A data set has been written to dirname."""
+    return os.path.exists(os.path.join(dirname, 'meta.json'))
+
+
+###
+# Step 1: task sets and cause-effect chains
+###
+
+def write_task_sets_chains(dirname, ts_ces, timebase=None):
+    """Write an iterable of (task set, [chains]) (task sets with computed wcrts).
+    timebase: tolerance of the time base the task sets were transformed with (see tasks.taskset.transform()).
+    Each item is appended to the columns on disk as soon as it is produced, so the memory does not grow with the
+    number of task sets; meta.json is written when all items are written. Returns the number of task sets."""
+    if not os.path.exists(dirname):
+        os.makedirs(dirname)
+    if exists(dirname):  # the data set is incomplete until meta.json is written again
+        os.remove(os.path.join(dirname, 'meta.json'))
+    writers = {col: _ColumnWriter(os.path.join(dirname, f'{col}.npy')) for col in TASK_COLUMNS}
+    for col in ('ts_start', 'ts_tick', 'chain_ts', 'chain_start', 'chain_tasks'):
+        writers[col] = _ColumnWriter(os.path.join(dirname, f'{col}.npy'), dtype=np.int64)
+
+    n_task_sets, n_chains, n_tasks, n_chain_tasks, with_ticks = 0, 0, 0, 0, False
+    for ts_id, (ts, ces) in enumerate(ts_ces):
+        ats = ArrayTaskSet.from_taskset(ts)
+        for col in TASK_COLUMNS:
+            writers[col].append(ats.columns[col])
+        writers['ts_start'].append([n_tasks])
+        writers['ts_tick'].append([ats.tick])
+        with_ticks = with_ticks or ats.tick != 1
+        chains = [ts.priorities(ce) for ce in ces]
+        lengths = [len(indices) for indices in chains]
+        writers['chain_ts'].append(np.full(len(chains), ts_id, dtype=np.int64))
+        writers['chain_start'].append(n_chain_tasks + np.cumsum([0] + lengths, dtype=np.int64)[:-1])
+        writers['chain_tasks'].append(np.array([idx for indices in chains for idx in indices], dtype=np.int64))
+        n_task_sets, n_chains = n_task_sets + 1, n_chains + len(chains)
+        n_tasks, n_chain_tasks = n_tasks + len(ts), n_chain_tasks + sum(lengths)
+
+    writers['ts_start'].append([n_tasks])
+    writers['chain_start'].append([n_chain_tasks])
+    for writer in writers.values():
+        writer.close()
+    if not with_ticks:  # data sets without time base have no ts_tick
+        os.remove(writers.pop('ts_tick').filename)
+
+    digest = _digest({col: _load_column(dirname, col) for col in writers})
+    with open(os.path.join(dirname, 'meta.json'), 'w') as file:
+        json.dump({'task_sets': n_task_sets, 'chains': n_chains, 'digest': digest, 'timebase': timebase}, file)
+    print(f'{n_task_sets} task sets with {n_chains} chains written to {dirname}')
+    return n_task_sets
+
+
+class TaskSetsChains:
+    """Task sets and chains of write_task_sets_chains(), memory-mapped."""
+
+    def __init__(self, dirname):
+        self.dirname = dirname
+        self.meta = _load_meta(dirname)
+        self._cols = dict()
+        self._has_ticks = os.path.exists(os.path.join(dirname, 'ts_tick.npy'))  # otherwise all ticks are 1
+
+    def column(self, col):
+        """Column of all tasks (or one of ts_start, chain_ts, chain_start, chain_tasks); loaded on first use."""
+        if col not in self._cols:
+            self._cols[col] = _load_column(self.dirname, col)
+        return self._cols[col]
+
+    def __len__(self):
+        return self.meta['task_sets']
+
+    def n_chains(self):
+        return self.meta['chains']
+
+    def digest(self):
+        """Content hash of the data set (e.g., as cache key)."""
+        if 'digest' not in self.meta:  # data sets of earlier versions
+            cols = TASK_COLUMNS + ('ts_start', 'chain_ts', 'chain_start', 'chain_tasks')
+            self.meta['digest'] = _digest({col: self.column(col) for col in cols})
+        return self.meta['digest']
+
+    def timebase(self):
+        """Tolerance of the time base of the task sets (None: no time base), see write_task_sets_chains()."""
+        return self.meta.get('timebase')
+
+    def tick(self, ts_id):
+        """Time base of task set ts_id (see tasks.taskset.transform())."""
+        return int(self.column('ts_tick')[ts_id]) if self._has_ticks else 1
+
+    def task_set(self, ts_id):
+        """ArrayTaskSet of task set ts_id (views of the columns)."""
+        start, stop = self.column('ts_start')[ts_id:ts_id + 2].tolist()
+        return ArrayTaskSet(tick=self.tick(ts_id), **{col: self.column(col)[start:stop] for col in TASK_COLUMNS})
+
+    def chain_indices(self, ts_id):
+        """Task indices (tuples) of the chains of task set ts_id."""
+        first, last = np.searchsorted(self.column('chain_ts'), [ts_id, ts_id + 1]).tolist()
+        starts = self.column('chain_start')[first:last + 1].tolist()
+        tasks = self.column('chain_tasks')[starts[0]:starts[-1]].tolist() if starts else []
+        return [tuple(tasks[start - starts[0]:stop - starts[0]]) for start, stop in zip(starts[:-1], starts[1:])]
+
+    def chains(self, ts_id):
+        """ArrayCEChains of task set ts_id."""
+        ats = self.task_set(ts_id)
+        return [ArrayCEChain(ats, indices) for indices in self.chain_indices(ts_id)]
+
+
+def load_task_sets_chains(dirname):
+    """Memory-mapped data set of write_task_sets_chains()."""
+    data = TaskSetsChains(dirname)
+    print(f'{len(data)} task sets with {data.n_chains()} chains loaded from {dirname}')
+    return data
+
+
+###
+# Step 2: analysis results
+###
+
+def _shard(spor, let, analysis):
+    """Column name of a result."""
+    return f'spor={spor}_let={let}_{analysis}'
+
+
+def write_result(dirname, spor, let, analysis, vals):
+    """Write one result vector (shard) as soon as it is complete.
+    The file is written under a temporary name and then renamed, so existing shards are always complete."""
+    if not os.path.exists(dirname):
+        os.makedirs(dirname)
+    filename = os.path.join(dirname, f'{_shard(spor, let, analysis)}.npy')
+    with open(filename + '.tmp', 'wb') as file:
+        np.save(file, np.asarray(vals))
+    os.replace(filename + '.tmp', filename)
+
+
+def result_exists(dirname, spor, let, analysis):
+    """The shard of the result has been written."""
+    return os.path.exists(os.path.join(dirname, f'{_shard(spor, let, analysis)}.npy'))
+
+
+def write_index(dirname, keys, params=None):
+    """Make the shards of the results keys [(spor, let, analysis)] (in this order) loadable with load_results().
+    params: json-serializable parameters the results were computed with (see load_params())."""
+    missing = [key for key in keys if not result_exists(dirname, *key)]
+    if missing:
+        raise ValueError(f'Results {missing} have not been written to {dirname}.')
+    if not os.path.exists(dirname):
+        os.makedirs(dirname)
+    with open(os.path.join(dirname, 'meta.json'), 'w') as file:
+        json.dump({'params': params, 'results': [[*key, _shard(*key)] for key in keys]}, file)
+
+
+def load_params(dirname):
+    """Parameters of the results in dirname as given to write_index() (None if there is no index)."""
+    if not exists(dirname):
+        return None
+    return _load_meta(dirname).get('params')
+
+
+def write_results(dirname, results):
+    """Write results {(spor, let, analysis): values}, one shard per entry."""
+    for key, vals in results.items():
+        write_result(dirname, *key, vals)
+    write_index(dirname, list(results))
+    print(f'Data written to {dirname}')
+
+
+def load_results(dirname):
+    """Results {(spor, let, analysis): values} of write_results() or write_index(); the vectors are memory-mapped."""
+    results = {(spor, let, analysis): _load_column(dirname, col)
+               for spor, let, analysis, col in _load_meta(dirname)['results']}
+    print(f'Data loaded from {dirname}')
+    return results
@@ -1,6 +1,8 @@
 import time
 import pickle
 import os
+from collections import deque
+from itertools import islice
 
 
 def time_now():
@@ -29,3 +31,47 @@ def load_data(filename):
     file.close()
     print(f'Data loaded from {filename}')
     return data
+
+
+def load_stream(filename):
+    """Items of a file of earlier versions with one pickle per item, one after the other.
+    Files written with write_data() that contain a list yield the items of the list."""
+    count = 0
+    with open(filename, 'rb') as file:
+        while True:
+            try:
+                item = pickle.load(file)
+            except EOFError:
+                break
+            if isinstance(item, list):
+                yield from item
+                count += len(item)
+            else:
+                yield item
+                count += 1
+    print(f'{count} items loaded from {filename}')
+
+
+def imap_bounded(pool, func, iterable, chunksize=64, max_pending=16, worker_stats=None, merge_stats=None):
+    """Results of func for the items of iterable (in order), computed by the pool in chunks of chunksize items.
+    Unlike Pool.imap, items are only taken from iterable while fewer than max_pending chunks are in progress,
+    so the memory does not grow with the length of iterable.
+    worker_stats: called in the worker after each chunk, its result is passed to merge_stats in this process
+    (e.g., counters of the worker that are reset by worker_stats)."""
+    iterator = iter(iterable)
+    pending = deque()
+    while True:
+        chunk = list(islice(iterator, chunksize))
+        if chunk:
+            pending.append(pool.apply_async(_map_chunk, (func, chunk, worker_stats)))
+        if pending and (not chunk or len(pending) >= max_pending):
+            results, stats = pending.popleft().get()
+            if merge_stats is not None:
+                merge_stats(stats)
+            yield from results
+        elif not chunk:
+            return
+
+
+def _map_chunk(func, chunk, worker_stats=None):
+    return [func(item) for item in chunk], worker_stats() if worker_stats is not None else None
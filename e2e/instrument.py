@@ -0,0 +1,99 @@
+"""Opt-in instrumentation of the analyses.
+Functions decorated with instrumented() count their calls, wall time and further metrics (e.g., chain length) in a
+registry of the process. When instrumentation is disabled (default), the only cost is one check per call.
+Worker processes send their counters with snapshot(reset=True); the parent combines them with merge() and writes
+them with dump().
+
+Registry: name -> metric -> [total, max].
+"""
+import csv
+import functools
+import json
+import time
+
+_enabled = False
+_registry = dict()
+
+
+def enable(flag=True):
+    """Switch instrumentation on (or off) for this process."""
+    global _enabled
+    _enabled = flag
+
+
+def enabled():
+    return _enabled
+
+
+def record(name, **values):
+    """Count one call of name with the values of its metrics (only if enabled)."""
+    if not _enabled:
+        return
+    entry = _registry.setdefault(name, dict())
+    for metric, value in (('calls', 1), *values.items()):
+        if metric in entry:
+            entry[metric][0] += value
+            entry[metric][1] = max(entry[metric][1], value)
+        else:
+            entry[metric] = [value, value]
+
+
+def instrumented(name, metrics=None):
+    """Decorator: record calls and wall time of the function as name.
+    metrics(result, *args, **kwargs) returns further values of the call, e.g., {'length': len(chain)}."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            result = func(*args, **kwargs)
+            duration = time.perf_counter() - start
+            record(name, time=duration, **(metrics(result, *args, **kwargs) if metrics is not None else dict()))
+            return result
+        return wrapper
+    return decorator
+
+
+def snapshot(reset=False):
+    """Copy of the registry of this process (reset: start counting again)."""
+    stats = {name: {metric: list(vals) for metric, vals in entry.items()} for name, entry in _registry.items()}
+    if reset:
+        _registry.clear()
+    return stats
+
+
+def merge(into, stats):
+    """Add the registry stats (e.g., of a worker) to the registry into."""
+    for name, entry in stats.items():
+        into_entry = into.setdefault(name, dict())
+        for metric, (total, maximum) in entry.items():
+            if metric in into_entry:
+                into_entry[metric][0] += total
+                into_entry[metric][1] = max(into_entry[metric][1], maximum)
+            else:
+                into_entry[metric] = [total, maximum]
+    return into
+
+
+def rows(reports):
+    """One row (label, name, metric, calls, total, mean per call, max) per metric of the reports {label: registry}."""
+    result = []
+    for label, stats in reports.items():
+        for name, entry in sorted(stats.items()):
+            calls = entry['calls'][0]
+            for metric, (total, maximum) in entry.items():
+                if metric != 'calls':
+                    result.append([label, name, metric, calls, total, total / calls, maximum])
+    return result
+
+
+def dump(filename, reports):
+    """Write the reports {label: registry} to filename.json and filename.csv."""
+    with open(filename + '.json', 'w') as file:
+        json.dump(reports, file, indent=1)
+    with open(filename + '.csv', 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(['label', 'name', 'metric', 'calls', 'total', 'mean', 'max'])
+        writer.writerows(rows(reports))
+    print(f'Instrumentation written to {filename}.json and {filename}.csv')
@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+"""Benchmarks of the generation and analysis functions on seeded fixtures.
+
+Run the benchmarks and store the results as JSON:
+    python3 e2e/microbench.py run [-o results.json] [-r repeat] [-q]
+Compare two runs (exit code 1 if a benchmark got slower by more than the threshold, default 0.1 = 10%):
+    python3 e2e/microbench.py compare old.json new.json [-t threshold]
+
+Each benchmark reports the time per call (minimum and median over the repetitions). The fixtures (task sets,
+chains and their types) are the same in every run. The segment cache of the analyses is disabled, and every
+repetition analyzes freshly compiled chain plans, so that the analyses themselves are measured.
+Besides the single functions, scaling curves are measured against the chain length, the task set size,
+the number of distinct periods and the ratio of hyperperiod and period.
+"""
+import getopt
+import json
+import platform
+import random
+import statistics
+import sys
+import time
+from functools import partial
+
+import numpy as np
+
+import analysis as ana
+import benchmark_WATERS as bench
+from analysis import ChainPlan
+from tasks.arraytaskset import ArrayTaskSet, REL_TYPES, COMM_TYPES
+from tasks.task import Task
+from tasks.taskset import TaskSet, transform, tda, compute_wcrts_batch
+
+SEED = 2718
+PERIODS = [1, 2, 5, 10, 20, 50, 100, 200, 1000]  # WATERS periods (ms)
+PRECISION = 10000000  # see tasks.taskset.transform()
+ENGINES = ('sweep', 'classes', 'numpy')
+
+
+###
+# Measurement
+###
+
+def measure(run, setup=lambda: None, repeat=5):
+    """Time per call of run(setup()), which returns its number of calls. setup is not timed."""
+    per_call = []
+    calls = 0
+    for _ in range(repeat):
+        state = setup()
+        start = time.perf_counter()
+        calls = run(state)
+        per_call.append((time.perf_counter() - start) / max(calls, 1))
+    return {'min': min(per_call), 'median': statistics.median(per_call), 'calls': calls, 'repeat': repeat}
+
+
+def _seeded(seed):
+    """Setup that seeds random and numpy.random."""
+    def setup():
+        random.seed(seed)
+        np.random.seed(seed)
+    return setup
+
+
+###
+# Fixtures
+###
+
+def fixture_task_sets(number):
+    """Task sets with chains as in step 1 (utilization 0.5 to 0.9)."""
+    seeds = np.random.SeedSequence(SEED).spawn(number)
+    ts_ces = []
+    for idx, seed in enumerate(seeds):
+        ts_ces.extend(bench.gen_tasksets_chains([0.5, 0.6, 0.7, 0.8, 0.9][idx % 5], [seed]))
+    return [ts_ce for ts_ce in ts_ces if ts_ce is not None]
+
+
+def fixture_chains(ts_ces, spor_ratio, LET_ratio, seed=SEED):
+    """(columns, task indices) of all chains, where per task set int(len * ratio) random tasks are sporadic / LET
+    (as in step 2)."""
+    rng = random.Random(seed)
+    chains = []
+    for ts, ces in ts_ces:
+        columns = dict(ArrayTaskSet.from_taskset(ts).columns)
+        rel = np.zeros(len(ts), dtype=np.int8)
+        comm = np.zeros(len(ts), dtype=np.int8)
+        rel[rng.sample(range(len(ts)), int(len(ts) * spor_ratio))] = REL_TYPES.index('sporadic')
+        comm[rng.sample(range(len(ts)), int(len(ts) * LET_ratio))] = COMM_TYPES.index('LET')
+        columns['rel'], columns['comm'] = rel, comm
+        chains.extend((columns, ts.priorities(ce)) for ce in ces)
+    return chains
+
+
+def plans(chains):
+    """Setup: freshly compiled plans of the chains (nothing cached yet)."""
+    return lambda: [ChainPlan.from_columns(columns, indices, indices) for columns, indices in chains]
+
+
+def synthetic_plan(periods, rng):
+    """Periodic chain with implicit communication with the periods (ms), random phases and priorities."""
+    periods = [int(period * PRECISION) for period in periods]
+    prios = list(range(len(periods)))
+    rng.shuffle(prios)
+    return ChainPlan(
+        periods=periods,
+        phases=[rng.randrange(period) for period in periods],
+        maxiats=periods,
+        dls=periods,
+        wcrts=[period // 10 for period in periods],
+        prios=prios,
+        rel_types=['periodic'] * len(periods),
+        comm_types=['implicit'] * len(periods))
+
+
+def synthetic_task_set(size, rng, util=0.7):
+    """Periodic task set with 'size' tasks with WATERS periods and equal utilization, ordered by period."""
+    tsks = [Task.from_values(release='periodic', period=period, phase=0, deadline='implicit', execution='wcet',
+                             wcet=util * period / size)
+            for period in sorted(rng.choice(PERIODS) for _ in range(size))]
+    ts = TaskSet(*tsks)
+    transform(ts)
+    return ts
+
+
+###
+# Benchmarks
+###
+
+def run_all(repeat=5, quick=False):
+    """All benchmarks: name -> measurement."""
+    ana.set_segment_cache(0)
+    results = dict()
+
+    def bench_it(name, run, setup=lambda: None):
+        results[name] = measure(run, setup, repeat)
+        print(f'{name}: {results[name]["median"] * 1e6:.1f}us per call')
+
+    ts_ces = fixture_task_sets(5 if quick else 20)
+    task_sets = [ts for ts, _ in ts_ces]
+
+    # Generation
+    def run_gen_taskset(_):
+        return len([bench.gen_taskset(0.7) for _ in range(2 if quick else 5)])
+
+    def run_compute_wcrts_batch(_):
+        compute_wcrts_batch(task_sets)
+        return len(task_sets)
+
+    bench_it('gen_taskset', run_gen_taskset, _seeded(SEED))
+    bench_it('sample_runnable_acet', lambda _: len([bench.sample_runnable_acet(period, 1000) for period in PERIODS]),
+             _seeded(SEED))
+    bench_it('gen_ce_chains', lambda _: len([bench.gen_ce_chains(ts) for ts in task_sets]), _seeded(SEED))
+    bench_it('compute_wcrts', lambda _: len([ts.compute_wcrts() for ts in task_sets]))
+    bench_it('compute_wcrts_batch', run_compute_wcrts_batch)
+    bench_it('tda', lambda _: len([tda(ts[-1], ts[:-1]) for ts in task_sets]))
+
+    # Analyses (the chains get the types they need, otherwise types as in step 2 with 50% sporadic / LET)
+    mixed = fixture_chains(ts_ces, 0.5, 0.5)
+    typed = {
+        'periodic_implicit': fixture_chains(ts_ces, 0.0, 0.0),
+        'periodic_LET': fixture_chains(ts_ces, 0.0, 1.0),
+        'sporadic_implicit': fixture_chains(ts_ces, 1.0, 0.0),
+        'sporadic_LET': fixture_chains(ts_ces, 1.0, 1.0),
+        'periodic_mixed': fixture_chains(ts_ces, 0.0, 0.5),
+        'sporadic_mixed': fixture_chains(ts_ces, 1.0, 0.5),
+        'mixed': mixed,
+    }
+    analyses = [
+        ('davare', ana.davare, 'sporadic_implicit'),
+        ('duerr', ana.duerr, 'sporadic_implicit'),
+        ('LET_spor', ana.LET_spor, 'sporadic_LET'),
+        ('mix_pessimistic', ana.mix_pessimistic, 'mixed'),
+        ('mix_sporadic', ana.mix_sporadic, 'sporadic_mixed'),
+        ('_cut_chain', ana._cut_chain, 'mixed'),
+    ]
+    for engine in ENGINES:
+        analyses += [
+            (f'impl_per[{engine}]', partial(ana.impl_per, engine=engine), 'periodic_implicit'),
+            (f'LET_per[{engine}]', partial(ana.LET_per, engine=engine), 'periodic_LET'),
+            (f'mix_periodic[{engine}]', partial(ana.mix_periodic, engine=engine), 'periodic_mixed'),
+            (f'mix[{engine}]', partial(ana.mix, engine=engine), 'mixed'),
+            (f'mix_improved[{engine}]', partial(ana.mix_improved, engine=engine), 'mixed'),
+        ]
+    for name, func, types in analyses:
+        bench_it(name, lambda plans_, func=func: len([func(plan) for plan in plans_]), plans(typed[types]))
+
+    # Scaling curves (periodic chains, synthetic values)
+    rng = random.Random(SEED)
+    per_point = 10 if quick else 50
+
+    def bench_curve(curve, point, chains):
+        for engine in ENGINES:
+            func = partial(ana.mix_periodic, engine=engine)
+            bench_it(f'scaling/{curve}/mix_periodic[{engine}]/{point}',
+                     lambda plans_, func=func: len([func(plan) for plan in plans_]),
+                     lambda chains=chains: [ChainPlan(*[list(getattr(plan, field)) for field in ChainPlan._fields])
+                                            for plan in chains])
+
+    for length in (2, 4, 8) if quick else (2, 4, 8, 16):
+        bench_curve('chain_length', f'L={length}',
+                    [synthetic_plan([rng.choice(PERIODS) for _ in range(length)], rng) for _ in range(per_point)])
+    for distinct in (1, 3, 9) if quick else (1, 2, 3, 5, 7, 9):
+        bench_curve('distinct_periods', f'k={distinct}',
+                    [synthetic_plan([PERIODS[idx % distinct] for idx in range(6)], rng) for _ in range(per_point)])
+    for ratio in (1, 10, 100) if quick else (1, 10, 100, 1000):
+        bench_curve('hyperperiod_ratio', f'r={ratio}',
+                    [synthetic_plan([1, ratio, 1], rng) for _ in range(per_point)])
+    for size in (10, 40) if quick else (10, 20, 40, 80):
+        sets = [synthetic_task_set(size, rng) for _ in range(per_point // 5)]
+        bench_it(f'scaling/taskset_size/compute_wcrts/N={size}', lambda _, sets=sets: len([
+            ts.compute_wcrts() for ts in sets]))
+
+    return results
+
+
+###
+# Compare
+###
+
+def compare(old, new, threshold=0.1):
+    """Compare the median times of two runs; returns the names of the benchmarks that are slower by more than
+    threshold."""
+    regressions = []
+    for name in sorted(set(old['results']) | set(new['results'])):
+        if name not in old['results'] or name not in new['results']:
+            print(f'{name}: only in {"new" if name in new["results"] else "old"} run')
+            continue
+        ratio = new['results'][name]['median'] / old['results'][name]['median']
+        if ratio > 1 + threshold:
+            flag = 'REGRESSION'
+            regressions.append(name)
+        elif ratio < 1 / (1 + threshold):
+            flag = 'faster'
+        else:
+            flag = ''
+        print(f'{name}: {old["results"][name]["median"] * 1e6:.1f}us -> {new["results"][name]["median"] * 1e6:.1f}us'
+              f' ({ratio:.2f}x) {flag}')
+    print(f'{len(regressions)} regressions (threshold {threshold:.0%})')
+    return regressions
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] not in ('run', 'compare'):
+        print(__doc__)
+        sys.exit(2)
+
+    if sys.argv[1] == 'run':
+        opts, args = getopt.gnu_getopt(sys.argv[2:], "o:r:q")
+        opts = dict(opts)
+        repeat = int(opts.get('-r', 5))
+        quick = '-q' in opts
+        results = run_all(repeat=repeat, quick=quick)
+        output = {
+            'meta': {'date': time.strftime('%Y-%m-%d %H:%M:%S'), 'python': platform.python_version(),
+                     'numpy': np.__version__, 'machine': platform.machine(), 'repeat': repeat, 'quick': quick},
+            'results': results
+        }
+        filename = opts.get('-o', 'microbench.json')
+        with open(filename, 'w') as file:
+            json.dump(output, file, indent=1)
+        print(f'Results written to {filename}')
+    else:
+        opts, args = getopt.gnu_getopt(sys.argv[2:], "t:")
+        if len(args) != 2:
+            print(__doc__)
+            sys.exit(2)
+        with open(args[0]) as file:
+            old = json.load(file)
+        with open(args[1]) as file:
+            new = json.load(file)
+        sys.exit(1 if compare(old, new, float(dict(opts).get('-t', 0.1))) else 0)
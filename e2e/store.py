@@ -0,0 +1,107 @@
+"""Jobs of step 2 and their evaluation in worker processes.
+The workers read the task sets from columnar data sets (see columnar.py). A job references a chain by
+(data_id, taskset_id, task_indices) and carries the release and communication types of its tasks
+(scenario_jobs()), so nothing has to be held in memory; the workers build the chain plans from the columns.
+"""
+import random
+import numpy as np
+from tasks.arraytaskset import REL_TYPES, COMM_TYPES
+import columnar
+import instrument
+import analysis
+
+
+def scenario_types(rel, comm, spor_ratio, LET_ratio, rng=random):
+    """Release and communication type codes of the tasks of one task set where int(len * spor_ratio) random tasks
+    are sporadic and int(len * LET_ratio) random tasks communicate with LET (the input arrays are not modified)."""
+    rel, comm = np.array(rel, dtype=np.int8), np.array(comm, dtype=np.int8)
+    rel[rng.sample(range(len(rel)), int(len(rel) * spor_ratio))] = REL_TYPES.index('sporadic')
+    comm[rng.sample(range(len(comm)), int(len(comm) * LET_ratio))] = COMM_TYPES.index('LET')
+    return rel, comm
+
+
+def scenario_jobs(datasets, spor_ratio, LET_ratio, rng=random):
+    """Jobs (data_id, taskset_id, task_indices, rel, comm) for all chains of the columnar data sets
+    (columnar.TaskSetsChains), with the type codes rel and comm of the chain tasks drawn as in scenario_types().
+    Generated one task set after the other."""
+    for data_id, data in enumerate(datasets):
+        starts = data.column('ts_start')
+        for ts_id in range(len(data)):
+            start, stop = starts[ts_id:ts_id + 2].tolist()
+            rel, comm = scenario_types(data.column('rel')[start:stop], data.column('comm')[start:stop],
+                                       spor_ratio, LET_ratio, rng)
+            for task_indices in data.chain_indices(ts_id):
+                yield (data_id, ts_id, task_indices,
+                       tuple(rel[list(task_indices)].tolist()), tuple(comm[list(task_indices)].tolist()))
+
+
+###
+# Worker processes
+###
+
+_datasets = None  # columnar data sets of this worker process
+
+
+def attach_data(dirnames, instrumentation=False, budget=(None, None)):
+    """Pool initializer: open the columnar data sets (memory-mapped) for evaluate_job().
+    instrumentation: enable instrument.py in the worker.
+    budget: (iterations, seconds) of mix() and mix_improved() in the worker, see analysis.set_budget()."""
+    global _datasets
+    _datasets = [columnar.TaskSetsChains(dirname) for dirname in dirnames]
+    instrument.enable(instrumentation)
+    analysis.set_budget(*budget)
+
+
+def worker_stats():
+    """Statistics of this worker since the last call: segment cache (see analysis.segment_cache_stats())
+    and instrumentation registry (see instrument.snapshot())."""
+    return analysis.segment_cache_stats(reset=True), instrument.snapshot(reset=True)
+
+
+_last_task_set = (None, None, 1)  # ((data_id, taskset_id), columns, tick) of the last job of this process
+
+
+def job_plan(datasets, job):
+    """Chain plan of a job of scenario_jobs() (values in the time base of the task set, see job_tick()).
+    The columns of the task set are kept for the next job (jobs come one task set after the other)."""
+    data_id, ts_id, task_indices, rel, comm = job
+    cols = _task_set_columns(datasets, data_id, ts_id)[0]
+    rows = np.asarray(task_indices, dtype=np.int64)
+    chain_cols = {col: values[rows] for col, values in cols.items()}
+    chain_cols['rel'], chain_cols['comm'] = np.asarray(rel, dtype=np.int8), np.asarray(comm, dtype=np.int8)
+    return analysis.ChainPlan.from_columns(chain_cols, slice(None), task_indices)
+
+
+def job_tick(datasets, job):
+    """Time base of the chain plan of a job: plan value * tick = value in the units of step 1."""
+    data_id, ts_id, *_ = job
+    return _task_set_columns(datasets, data_id, ts_id)[1]
+
+
+def _task_set_columns(datasets, data_id, ts_id):
+    """Columns and time base of task set ts_id of data set data_id, kept for the next call."""
+    global _last_task_set
+    key, cols, tick = _last_task_set
+    if key != (data_id, ts_id):
+        data = datasets[data_id]
+        start, stop = data.column('ts_start')[ts_id:ts_id + 2].tolist()
+        cols = {col: np.array(data.column(col)[start:stop]) for col in ('period', 'phase', 'maxiat', 'dl', 'wcrt')}
+        tick = data.tick(ts_id)
+        _last_task_set = ((data_id, ts_id), cols, tick)
+    return cols, tick
+
+
+def evaluate_job(analyses, job):
+    """Apply several analyses to the chain of a job of scenario_jobs().
+    Returns the results (in the units of step 1) and the positions of the analyses whose result is only an upper
+    bound because the budget of the process was exceeded (see analysis.set_budget())."""
+    plan = job_plan(_datasets, job)
+    tick = job_tick(_datasets, job)
+    budget = analysis.current_budget()
+    results, approximate = [], []
+    for idx, func in enumerate(analyses):
+        exceeded = budget.exceeded
+        results.append(func(plan) * tick)
+        if budget.exceeded > exceeded:
+            approximate.append(idx)
+    return tuple(results), tuple(approximate)
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+import math
+import numpy as np
+from tasks.task import Task
+from tasks.taskset import TaskSet
+from cechains.chain import CEChain
+
+# Codes of the types in the arrays
+REL_TYPES = ('periodic', 'sporadic')
+COMM_TYPES = ('implicit', 'LET')
+DL_TYPES = ('arbitrary', 'constrained', 'implicit')
+
+
+class ArrayTaskSet:
+    """A task set as NumPy arrays (struct-of-arrays), indexed by priority.
+
+    Numerical columns are int64 if all values are integers (see tasks.taskset.transform), otherwise float64 with
+    NaN for missing values. Types are stored as codes into REL_TYPES, COMM_TYPES and DL_TYPES (-1: missing).
+    tick: time base of the values (see TaskSet.tick)."""
+
+    value_columns = ('period', 'phase', 'miniat', 'maxiat', 'wcet', 'bcet', 'dl', 'wcrt')
+    type_columns = ('rel', 'comm', 'dl_type')
+
+    def __init__(self, tick=1, **columns):
+        """Input: one array per column of value_columns and type_columns, all of the same length."""
+        lengths = {len(columns[col]) for col in self.value_columns + self.type_columns}
+        if len(lengths) != 1:
+            raise ValueError(f'Columns of equal length expected. Received lengths {lengths}.')
+        self.columns = {col: np.asarray(columns[col]) for col in self.value_columns + self.type_columns}
+        self.tick = tick
+
+    def __getattr__(self, item):
+        """Columns as attributes, e.g., ats.period."""
+        columns = self.__dict__.get('columns', dict())
+        if item in columns:
+            return columns[item]
+        raise AttributeError(item)
+
+    def __len__(self):
+        return len(self.columns['period'])
+
+    @classmethod
+    def from_taskset(cls, taskset):
+        """Array form of a TaskSet (wcrt from taskset.wcrts if computed)."""
+        wcrts = getattr(taskset, 'wcrts', dict())
+        values = {
+            'period': [getattr(tsk.rel, 'period', None) for tsk in taskset],
+            'phase': [getattr(tsk.rel, 'phase', None) for tsk in taskset],
+            'miniat': [tsk.rel.miniat for tsk in taskset],
+            'maxiat': [tsk.rel.maxiat for tsk in taskset],
+            'wcet': [tsk.ex.wcet for tsk in taskset],
+            'bcet': [tsk.ex.bcet for tsk in taskset],
+            'dl': [tsk.dl.dl if hasattr(tsk, 'dl') else None for tsk in taskset],
+            'wcrt': [wcrts.get(tsk) for tsk in taskset],
+        }
+        columns = {col: _value_array(vals) for col, vals in values.items()}
+        columns['rel'] = _type_array([tsk.rel.type for tsk in taskset], REL_TYPES)
+        columns['comm'] = _type_array([tsk.comm.type if hasattr(tsk, 'comm') else None for tsk in taskset],
+                                      COMM_TYPES)
+        columns['dl_type'] = _type_array([tsk.dl.type if hasattr(tsk, 'dl') else None for tsk in taskset], DL_TYPES)
+        return cls(tick=getattr(taskset, 'tick', 1), **columns)
+
+    def to_taskset(self):
+        """TaskSet with new Task objects (and wcrts if all are known)."""
+        cols = {col: column_values(self.columns[col]) for col in self.value_columns}
+        tsks = []
+        for idx in range(len(self)):
+            kwargs = dict(execution='bcwc', wcet=cols['wcet'][idx], bcet=cols['bcet'][idx])
+            if cols['period'][idx] is not None:
+                kwargs.update(release='periodic', period=cols['period'][idx], phase=cols['phase'][idx])
+            else:
+                kwargs.update(release='sporadic', miniat=cols['miniat'][idx], maxiat=cols['maxiat'][idx])
+            if self.columns['dl_type'][idx] >= 0:
+                kwargs.update(deadline=DL_TYPES[self.columns['dl_type'][idx]])
+                if DL_TYPES[self.columns['dl_type'][idx]] != 'implicit':
+                    kwargs.update(dl=cols['dl'][idx])
+            if self.columns['comm'][idx] >= 0:
+                kwargs.update(communication=COMM_TYPES[self.columns['comm'][idx]])
+            tsk = Task(**kwargs)
+            tsk.rel.type = REL_TYPES[self.columns['rel'][idx]]  # periodic tasks may be analyzed as sporadic
+            tsks.append(tsk)
+
+        taskset = TaskSet(*tsks)
+        taskset.tick = self.tick
+        if all(wcrt is not None for wcrt in cols['wcrt']):
+            taskset.wcrts = dict(zip(tsks, cols['wcrt']))
+        return taskset
+
+    def chain(self, ce):
+        """Array form of a CEChain with this task set (in array form) as base."""
+        return ArrayCEChain(self, ce.base_ts.priorities(ce))
+
+    def utilization(self):
+        return float(np.sum(self.columns['wcet'] / self.columns['miniat']))
+
+    def hyperperiod(self):
+        """Task set hyperperiod."""
+        return math.lcm(*self.columns['period'].tolist())
+
+    def max_phase(self):
+        """Maximal phase of the task set."""
+        return max(self.columns['phase'].tolist())
+
+
+class ArrayCEChain:
+    """A cause-effect chain as array of task indices (priorities) into an ArrayTaskSet."""
+
+    def __init__(self, base_ts, indices):
+        self.base_ts = base_ts
+        self.indices = np.asarray(indices, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.indices)
+
+    def to_chain(self, taskset):
+        """CEChain of the tasks of the TaskSet (e.g., from base_ts.to_taskset())."""
+        return CEChain(*[taskset[idx] for idx in self.indices.tolist()], base_ts=taskset)
+
+
+def _value_array(values):
+    """int64 array if all values are integers, otherwise float64 array with NaN for None."""
+    if all(isinstance(val, (int, np.integer)) for val in values):
+        return np.array(values, dtype=np.int64)
+    return np.array([np.nan if val is None else val for val in values], dtype=np.float64)
+
+
+def column_values(array):
+    """Python values of a column (None for NaN)."""
+    if array.dtype.kind == 'f':
+        return [None if math.isnan(val) else val for val in array.tolist()]
+    return array.tolist()
+
+
+def _type_array(types, possibilities):
+    """Codes of the types (-1 for None)."""
+    for typ in types:
+        if typ is not None and typ not in possibilities:
+            raise ValueError(f'{typ} is not in {possibilities}.')
+    return np.array([-1 if typ is None else possibilities.index(typ) for typ in types], dtype=np.int8)
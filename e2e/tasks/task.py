@@ -4,7 +4,13 @@
 # Task Features.
 ####################
 class TaskFeature:
+    """Base class of the task features.
+    The features have slots instead of a __dict__. Values are either set with checks (constructor, properties)
+    or, for trusted input, without checks (from_values(), set_values()) and checked once afterwards (check())."""
+    __slots__ = ('_type',)
     _features = []
+    _default_type = None  # type if not set for the instance
+    _derived = ()  # values that are not stored but derived from other values
 
     def __str__(self):
         ret_str = self.__repr__() + ':\t'
@@ -12,15 +18,74 @@ class TaskFeature:
             ret_str += f'{feat}={getattr(self, feat)}, '
         return ret_str
 
+    @property
+    def type(self):
+        """Type of the feature (can be changed per instance, e.g., periodic tasks analyzed as sporadic)."""
+        try:
+            return self._type
+        except AttributeError:
+            return self._default_type
+
+    @type.setter
+    def type(self, value):
+        self._type = value
+
+    @classmethod
+    def _slots(cls):
+        """All slots of the class."""
+        if '_all_slots' not in cls.__dict__:
+            cls._all_slots = tuple(slot for c in reversed(cls.__mro__) for slot in c.__dict__.get('__slots__', ()))
+        return cls._all_slots
+
+    def __getstate__(self):
+        return {slot: getattr(self, slot) for slot in self._slots() if hasattr(self, slot)}
+
+    def __setstate__(self, state):
+        """Also accepts the __dict__ of features pickled before they had slots (e.g., 'dl' instead of '_dl')."""
+        slots = self._slots()
+        for name, value in state.items():
+            setattr(self, name if name in slots else '_' + name, value)
+
+    @classmethod
+    def _initial_values(cls, **kwargs):
+        """Slot -> value as set by the constructor with the same arguments."""
+        return dict()
+
+    @classmethod
+    def from_values(cls, **kwargs):
+        """Trusted constructor: same arguments as the constructor, but no checks."""
+        feat = cls.__new__(cls)
+        for slot, value in cls._initial_values(**kwargs).items():
+            setattr(feat, slot, value)
+        return feat
+
+    def set_values(self, **values):
+        """Trusted update of values (by their public names) without checks. Derived values are skipped."""
+        slots = self._slots()
+        for name, value in values.items():
+            if name not in self._derived:
+                setattr(self, '_' + name if '_' + name in slots else name, value)
+
+    def check(self):
+        """Raise ValueError if the values of the feature are inconsistent."""
+        pass
+
+
+def _check_non_negative(**values):
+    for name, value in values.items():
+        if value is not None and value < 0:
+            raise ValueError(f'Non-negative value expected. Received {name}={value}.')
+
 
 # Task Features: Release Pattern
 class ReleasePattern(TaskFeature):
+    __slots__ = ()
     _features = TaskFeature._features + ['type']
-    type = None
 
 
 class Sporadic(ReleasePattern):
-    type = 'sporadic'
+    __slots__ = ('_maxiat', '_miniat')
+    _default_type = 'sporadic'
     _features = ReleasePattern._features + ['miniat', 'maxiat']
 
     def __init__(self, maxiat=None, miniat=None, **kwargs):
@@ -28,6 +93,15 @@ class Sporadic(ReleasePattern):
         self.maxiat = maxiat
         self.miniat = miniat
 
+    @classmethod
+    def _initial_values(cls, maxiat=None, miniat=None, **kwargs):
+        return {'_maxiat': maxiat, '_miniat': miniat}
+
+    def check(self):
+        _check_non_negative(maxiat=self._maxiat, miniat=self._miniat)
+        if self._miniat is not None and self._maxiat is not None and self._miniat > self._maxiat:
+            raise ValueError(f'miniat <= maxiat expected. Received {self._miniat=} > {self._maxiat=}.')
+
     @property
     def maxiat(self):
         return self._maxiat
@@ -56,7 +130,8 @@ class Sporadic(ReleasePattern):
 
 
 class Periodic(Sporadic):
-    type = 'periodic'
+    __slots__ = ('_period', 'phase')
+    _default_type = 'periodic'
     _features = Sporadic._features + ['period', 'phase']
 
     def __init__(self, period=None, phase=None, **kwargs):
@@ -69,6 +144,14 @@ class Periodic(Sporadic):
         self.period = period
         self.phase = phase
 
+    @classmethod
+    def _initial_values(cls, period=None, phase=None, **kwargs):
+        return {**super()._initial_values(miniat=period, maxiat=period), '_period': period, 'phase': phase}
+
+    def check(self):
+        super().check()
+        _check_non_negative(period=self._period)
+
     @property
     def period(self):
         return self._period
@@ -82,27 +165,50 @@ class Periodic(Sporadic):
 
 # Task Features: Deadline
 class Deadline(TaskFeature):
-    type = None
+    __slots__ = ()
     _features = TaskFeature._features + ['type']
 
 
 class ArbitraryDeadline(Deadline):
-    type = 'arbitrary'
+    __slots__ = ('_dl',)
+    _default_type = 'arbitrary'
     _features = Deadline._features + ['dl']
 
     def __init__(self, dl=None, **kwargs):
         # this
         self.dl = dl
 
+    @classmethod
+    def _initial_values(cls, dl=None, **kwargs):
+        return {'_dl': dl}
+
+    @property
+    def dl(self):
+        return self._dl
+
+    @dl.setter
+    def dl(self, value):
+        self._dl = value
+
 
 class ConstrainedDeadline(ArbitraryDeadline):
-    type = 'constrained'
+    __slots__ = ('_base_tsk',)
+    _default_type = 'constrained'
 
     def __init__(self, dl=None, tsk=None, **kwargs):
         self._base_tsk = tsk  # base task
         # super
         super().__init__(dl=dl, **kwargs)  # set deadline
 
+    @classmethod
+    def _initial_values(cls, dl=None, tsk=None, **kwargs):
+        return {'_base_tsk': tsk, '_dl': dl}
+
+    def check(self):
+        if self._base_tsk is not None and self.dl is not None and hasattr(self._base_tsk, 'rel'):
+            if self._base_tsk.rel.miniat is not None and self._base_tsk.rel.miniat < self.dl:
+                raise ValueError(f'Expected dl <= miniat. Received {self.dl=} > {self._base_tsk.rel.miniat=}.')
+
     @property
     def dl(self):
         return self._dl
@@ -118,7 +224,13 @@ class ConstrainedDeadline(ArbitraryDeadline):
 
 
 class ImplicitDeadline(ConstrainedDeadline):
-    type = 'implicit'
+    __slots__ = ()
+    _default_type = 'implicit'
+    _derived = ('dl',)
+
+    @classmethod
+    def _initial_values(cls, tsk=None, **kwargs):
+        return {'_base_tsk': tsk}
 
     @property
     def dl(self):
@@ -143,18 +255,28 @@ class ImplicitDeadline(ConstrainedDeadline):
 # TODO add suspension
 # TODO this place can also be used to implement tasks with probabilistic execution behavior
 class Execution(TaskFeature):
-    type = None
+    __slots__ = ()
     _features = TaskFeature._features + ['type']
 
 
 class BCWCExecution(Execution):
-    type = 'bcwc'
+    __slots__ = ('_bcet', '_wcet')
+    _default_type = 'bcwc'
     _features = Execution._features + ['bcet', 'wcet']
 
     def __init__(self, bcet=None, wcet=None, **kwargs):
         self.bcet = bcet
         self.wcet = wcet
 
+    @classmethod
+    def _initial_values(cls, bcet=None, wcet=None, **kwargs):
+        return {'_bcet': bcet, '_wcet': wcet}
+
+    def check(self):
+        _check_non_negative(bcet=self._bcet, wcet=self._wcet)
+        if self._bcet is not None and self._wcet is not None and self._bcet > self._wcet:
+            raise ValueError(f'bcet <= wcet expected. Received: {self._bcet=} > {self._wcet=}.')
+
     @property
     def bcet(self):
         return self._bcet
@@ -186,12 +308,21 @@ class BCWCExecution(Execution):
 
 # Task Features: Communication Policy
 class Communication(TaskFeature):
+    __slots__ = ()
     _features = TaskFeature._features + ['type']
     _comm_possibilities = ('implicit', 'LET')
 
     def __init__(self, communication, **kwargs):
         self.type = communication
 
+    @classmethod
+    def _initial_values(cls, communication=None, **kwargs):
+        return {'_type': communication}
+
+    def check(self):
+        if self._type is not None and self._type not in self._comm_possibilities:
+            raise ValueError(f'{self._type} is not in {self._comm_possibilities}.')
+
     @property
     def type(self):
         return self._type
@@ -259,14 +390,27 @@ class Task:
         if communication is not None:
             self.add_feature('communication', communication, **kwargs)
 
-    def add_feature(self, feature, argument, **kwargs):
+    @classmethod
+    def from_values(cls, release=None, deadline=None, execution=None, communication=None, **kwargs):
+        """Trusted constructor: same arguments as the constructor, but the values are not checked.
+        Check the tasks afterwards with check_tasks()."""
+        tsk = cls.__new__(cls)
+        kwargs['tsk'] = tsk  # add pointer to task
+        for feature, argument in (('release', release), ('deadline', deadline), ('execution', execution),
+                                  ('communication', communication)):
+            if argument is not None:
+                tsk.add_feature(feature, argument, trusted=True, **kwargs)
+        return tsk
+
+    def add_feature(self, feature, argument, trusted=False, **kwargs):
+        """trusted: create the feature without checks (see TaskFeature.from_values())."""
         feature_attribute, possible_arguments = self.features[feature]
         if argument not in possible_arguments.keys():
             raise ValueError(f'{argument} is not a possible argument.')
         kwargs[feature] = argument  # add feature and argument back
 
         feature_class = possible_arguments[argument]
-        setattr(self, feature_attribute, feature_class(**kwargs))
+        setattr(self, feature_attribute, feature_class.from_values(**kwargs) if trusted else feature_class(**kwargs))
 
     def print(self):
         """Quick print of all features for debugging."""
@@ -280,6 +424,15 @@ class Task:
         return (self.ex.wcet / self.rel.miniat)
 
 
+def check_tasks(tsks):
+    """Check the features of all tasks at once (e.g., after Task.from_values() or trusted updates).
+    Raises ValueError for inconsistent values."""
+    for tsk in tsks:
+        for feature_attribute, _ in Task.features.values():
+            if hasattr(tsk, feature_attribute):
+                getattr(tsk, feature_attribute).check()
+
+
 if __name__ == '__main__':
     """Debugging."""
     tsks = dict()
@@ -1,5 +1,9 @@
 #!/usr/bin/env python3
 import math
+from fractions import Fraction
+import numpy as np
+from tasks.task import check_tasks
+from instrument import instrumented
 
 
 class TaskSet:
@@ -10,6 +14,27 @@ class TaskSet:
     def __init__(self, *args):
         """Input: Task-Objects"""
         self._lst = list(args)
+        self.tick = 1  # time base of the values, see transform()
+        self.reset_indices()
+
+    def __setstate__(self, state):
+        """Pickles written before the indices (or the time base) existed do not carry them."""
+        self.tick = 1
+        self.__dict__.update(state)
+        self.reset_indices()
+
+    def __getstate__(self):
+        """The indices are rebuilt on demand and not pickled, neither is the bookkeeping of update_wcrts()."""
+        state = self.__dict__.copy()
+        for key in ('_prio_index', '_period_index', '_wcrt_params', '_wcrt_order', '_tda_iterations'):
+            state.pop(key, None)
+        return state
+
+    def reset_indices(self):
+        """Drop the priority and period indices; they are rebuilt when needed.
+        Called on every change of the task set. Call it after changing periods of the tasks directly."""
+        self._prio_index = None  # task -> priority
+        self._period_index = None  # period -> tasks
 
     def __len__(self):
         return self._lst.__len__()
@@ -19,23 +44,55 @@ class TaskSet:
 
     def __setitem__(self, key, value):
         self._lst.__setitem__(key, value)
+        self.reset_indices()
 
     def __delitem__(self, key):
         self._lst.__delitem__(key)
+        self.reset_indices()
 
     def __iter__(self):
         yield from self._lst
 
     def append(self, obj):
         self._lst.append(obj)
+        if self._prio_index is not None and obj not in self._prio_index:
+            self._prio_index[obj] = len(self._lst) - 1
+        self._period_index = None
+
+    def _priorities_index(self):
+        """Dictionary task -> priority (position of the first occurrence)."""
+        if self._prio_index is None:
+            index = dict()
+            for idx, tsk in enumerate(self._lst):
+                index.setdefault(tsk, idx)
+            self._prio_index = index
+        return self._prio_index
 
     def prio(self, tsk):
         """Priority of a task"""
-        return self._lst.index(tsk)
+        try:
+            return self._priorities_index()[tsk]
+        except KeyError:
+            raise ValueError(f'{tsk} is not in the task set.') from None
+
+    def priorities(self, tsks=None):
+        """Priorities of several tasks at once (default: all tasks of the task set).
+        The returned list can be used directly by analyses instead of repeated calls of prio()."""
+        index = self._priorities_index()
+        if tsks is None:
+            tsks = self._lst
+        try:
+            return [index[tsk] for tsk in tsks]
+        except KeyError as err:
+            raise ValueError(f'{err.args[0]} is not in the task set.') from None
 
     def higher_prio(self, tsk1, tsk2):
         """tsk1 has higher prio than tsk2."""
-        return self.prio(tsk1) < self.prio(tsk2)
+        index = self._priorities_index()
+        try:
+            return index[tsk1] < index[tsk2]
+        except KeyError as err:
+            raise ValueError(f'{err.args[0]} is not in the task set.') from None
 
     def utilization(self):
         return sum(tsk.utilization() for tsk in self)
@@ -83,8 +140,72 @@ class TaskSet:
     def compute_wcrts(self):
         """Compute wcrts by TDA."""
         self.wcrts = dict()
+        self._tda_iterations = dict()
         for idx in range(len(self._lst)):
-            self.wcrts[self._lst[idx]] = tda(self._lst[idx], self._lst[:idx])
+            self.wcrts[self._lst[idx]], self._tda_iterations[self._lst[idx]] = _tda(self._lst[idx], self._lst[:idx])
+        self._snapshot_wcrt_params()
+
+    def update_wcrts(self, changed_tasks):
+        """Recompute wcrts after the parameters (miniat, wcet) of changed_tasks or the priority order changed.
+        Tasks with higher priority than all changed tasks keep their wcrt. The fixed-point iteration of the other
+        tasks is warm-started from the previous wcrt if the demand of the task and of all its higher priority tasks
+        did not decrease (then the previous wcrt is a lower bound of the new one).
+        Returns the number of TDA iterations saved compared to the previous computation."""
+        if not hasattr(self, '_wcrt_params'):
+            self.compute_wcrts()
+            return 0
+
+        old_params, old_order, old_iterations = self._wcrt_params, self._wcrt_order, self._tda_iterations
+        prio_index = self._priorities_index()
+
+        # First priority level that has to be recomputed
+        first = min([self.prio(tsk) for tsk in changed_tasks] + [len(self._lst)])
+        for idx, (tsk, old_tsk) in enumerate(zip(self._lst, old_order)):
+            if idx >= first or tsk is not old_tsk:
+                first = min(first, idx)
+                break
+        else:
+            first = min(first, len(old_order))
+
+        # Old higher priority tasks must still have higher priority; -1 if no old higher priority task
+        old_hp_prio = dict()
+        hp_prio = -1
+        for old_tsk in old_order:
+            old_hp_prio[old_tsk] = hp_prio
+            hp_prio = max(hp_prio, prio_index.get(old_tsk, len(self._lst)))
+
+        saved = sum(old_iterations.get(tsk, 0) for tsk in self._lst[:first])
+        demand_not_decreased = all(self._demand_not_decreased(tsk, old_params) for tsk in self._lst[:first])
+        for idx in range(first, len(self._lst)):
+            tsk = self._lst[idx]
+            demand_not_decreased = demand_not_decreased and self._demand_not_decreased(tsk, old_params)
+            if demand_not_decreased and tsk in old_params and old_hp_prio[tsk] < idx:
+                self.wcrts[tsk], iterations = _tda(tsk, self._lst[:idx], r=self.wcrts[tsk])
+                saved += max(old_iterations[tsk] - iterations, 0)
+            else:
+                self.wcrts[tsk], iterations = _tda(tsk, self._lst[:idx])
+            self._tda_iterations[tsk] = iterations
+
+        # Remove tasks that are not in the task set anymore
+        for tsk in set(self.wcrts) - set(self._lst):
+            del self.wcrts[tsk]
+            del self._tda_iterations[tsk]
+
+        self._snapshot_wcrt_params()
+        return saved
+
+    def _snapshot_wcrt_params(self):
+        """Store the parameters the wcrts are based on (used by update_wcrts())."""
+        self._wcrt_params = {tsk: (tsk.rel.miniat, tsk.ex.wcet) for tsk in self._lst}
+        self._wcrt_order = list(self._lst)
+
+    @staticmethod
+    def _demand_not_decreased(tsk, old_params):
+        """Task is new, or wcet did not decrease and miniat did not increase."""
+        if tsk not in old_params:
+            return True
+        old_miniat, old_wcet = old_params[tsk]
+        return tsk.ex.wcet >= old_wcet and tsk.rel.miniat <= old_miniat
 
     def hyperperiod(self):
         """Task set hyperperiod."""
@@ -97,11 +218,27 @@ class TaskSet:
     def sort_dm(self):
         """Sort by deadline."""
         self._lst.sort(key=lambda x: x.dl.dl)
+        self.reset_indices()
+
+    def tasks_by_period(self):
+        """Dictionary period -> tasks with that period (in priority order).
+        Periods are ordered by their first occurrence. Built once and reused until the task set changes."""
+        if self._period_index is None:
+            index = dict()
+            for tsk in self._lst:
+                index.setdefault(tsk.rel.period, []).append(tsk)
+            self._period_index = index
+        return self._period_index
 
 
-def transform(taskset, precision=10000000):
+def transform(taskset, precision=10000000, timebase=None):
     """"Multiplies the following values for each task with precision and makes integer.
-    (Important for analyses with hyperperiod)."""
+    (Important for analyses with hyperperiod).
+    timebase: if not None, the values are then expressed in the coarsest time base (tick) for which each wcet and
+    bcet changes by at most timebase * period of its task (wcet rounded up, bcet down), while periods, inter-arrival
+    times, deadlines and phases stay exact; see _timebase(). Execution times only become less precise in the safe
+    direction, so the results of the analyses are upper bounds for the task set without time base.
+    The tick is stored as taskset.tick: value * tick is the value in units of 1/precision."""
     transform_arguments = {
         'rel': ['maxiat', 'miniat', 'period', 'phase'],
         'dl': ['dl'],
@@ -109,6 +246,9 @@ def transform(taskset, precision=10000000):
         'comm': []
     }
 
+    if isinstance(taskset, TaskSet):
+        taskset.reset_indices()  # periods change
+
     for tsk in taskset:
         # get all relevant values:
         tsk_vals = dict()
@@ -120,13 +260,82 @@ def transform(taskset, precision=10000000):
                     if hasattr(tsk_feat, targarg):
                         tsk_vals[targ][targarg] = getattr(tsk_feat, targarg)
 
-        # Transform and set relevant values
+        # Transform and set relevant values (without checks, the task set is checked once below)
         for targ in tsk_vals:
-            feat = getattr(tsk, targ)
-            for targarg in tsk_vals[targ]:
-                if tsk_vals[targ][targarg] is not None:
-                    setattr(feat, targarg,
-                            int(tsk_vals[targ][targarg] * precision))
+            getattr(tsk, targ).set_values(**{targarg: int(val * precision)
+                                             for targarg, val in tsk_vals[targ].items() if val is not None})
+
+    if timebase is not None:
+        tick = _timebase(taskset, timebase)
+        for tsk in taskset:
+            tsk.rel.set_values(**{targarg: getattr(tsk.rel, targarg) // tick
+                                  for targarg in ('period', 'maxiat', 'miniat', 'phase')
+                                  if getattr(tsk.rel, targarg, None) is not None})
+            if hasattr(tsk, 'dl'):
+                tsk.dl.set_values(dl=tsk.dl.dl // tick)
+            tsk.ex.set_values(wcet=-(-tsk.ex.wcet // tick),
+                              **({'bcet': tsk.ex.bcet // tick} if tsk.ex.bcet is not None else dict()))
+        if isinstance(taskset, TaskSet):
+            taskset.tick *= tick
+
+    check_tasks(taskset)
+
+
+def _timebase(taskset, tolerance):
+    """Largest tick that divides all periods, inter-arrival times, phases and deadlines (of integer values) and for
+    which rounding each wcet up and bcet down to a multiple of tick changes it by at most tolerance * period of its
+    task (maxiat for sporadic tasks). Ticks for which the rounded wcets would raise the utilization to 1 or more
+    are not used (TDA would not terminate).
+    Random phases usually have no common divisor with the periods, then the tick is 1."""
+    exact = [getattr(tsk.rel, targarg, None) for tsk in taskset
+             for targarg in ('period', 'maxiat', 'miniat', 'phase')]
+    exact += [tsk.dl.dl for tsk in taskset if hasattr(tsk, 'dl')]
+    exact = [val for val in exact if val is not None]
+    if not all(isinstance(val, (int, np.integer)) for val in exact):
+        raise ValueError('Integer values expected. Transform the task set with precision first.')
+
+    # Values that are rounded, with their allowed change
+    rounded = []
+    for tsk in taskset:
+        allowed = tolerance * (getattr(tsk.rel, 'period', None) or tsk.rel.maxiat)
+        rounded += [(tsk.ex.wcet, 1, allowed)]
+        if tsk.ex.bcet is not None:
+            rounded += [(tsk.ex.bcet, -1, allowed)]
+    schedulable = _utilization(taskset, 1) < 1
+
+    for tick in sorted(_divisors(math.gcd(*exact)), reverse=True):
+        if (all(abs(_round_to(val, tick, direction) - val) <= allowed for val, direction, allowed in rounded)
+                and (not schedulable or _utilization(taskset, tick) < 1)):
+            return tick
+    return 1
+
+
+def _utilization(taskset, tick):
+    """Utilization of the task set with the wcets rounded up to multiples of tick (exact)."""
+    return sum(Fraction(_round_to(tsk.ex.wcet, tick, 1), tsk.rel.miniat) for tsk in taskset)
+
+
+def _round_to(val, tick, direction):
+    """val rounded up (direction 1) or down (-1) to a multiple of tick."""
+    if direction > 0:
+        return -(-val // tick) * tick
+    return val // tick * tick
+
+
+def _divisors(number):
+    """All positive divisors of number (0: only 1)."""
+    divisors = [1]
+    factor = 2
+    while number > 1:
+        if factor * factor > number:
+            factor = number
+        power = 0
+        while number % factor == 0:
+            number //= factor
+            power += 1
+        divisors = [div * factor ** exp for div in divisors for exp in range(power + 1)]
+        factor += 1
+    return divisors
 
 
 def tda(tsk, hp_tsks):
@@ -134,23 +343,105 @@ def tda(tsk, hp_tsks):
     Source:
     https://github.com/kuanhsunchen/MissRateSimulator/blob/master/TDA.py
     """
+    return _tda(tsk, hp_tsks)[0]
+
+
+@instrumented('tda', lambda result, tsk, hp_tsks, r=None: {'iterations': result[1], 'hp_tasks': len(hp_tsks)})
+def _tda(tsk, hp_tsks, r=None):
+    """TDA starting the fixed-point iteration at r (default: wcet).
+    r must not be larger than the worst-case response time.
+    Returns worst-case response time and number of iterations."""
     c = tsk.ex.wcet  # WCET
-    r = c  # WCRT
+    if r is None or r < c:
+        r = c  # WCRT
+    iterations = 0
     while True:
+        iterations += 1
         i = 0  # interference
         for itsk in hp_tsks:
             i = i + _workload(itsk.rel.miniat, itsk.ex.wcet, r)
         if r < i + c:
             r = i + c
         else:
-            return r
+            return r, iterations
 
 
 def _workload(period, wcet, time):
     """Workload function for TDA.
     Help function for tda().
+    (Ceil-division without float rounding.)
     """
-    return wcet * math.ceil(float(time) / period)
+    return wcet * -(-time // period)
+
+
+def compute_wcrts_batch(task_sets, chunk=64):
+    """Compute wcrts by TDA for many task sets at once (same result as TaskSet.compute_wcrts()).
+    The fixed-point iterations of 'chunk' task sets are done simultaneously on padded int64 arrays.
+    Task sets with non-integer values, or whose values could overflow int64, are handled by compute_wcrts()."""
+    task_sets = list(task_sets)
+    for start in range(0, len(task_sets), chunk):
+        _tda_batch(task_sets[start:start + chunk])
+
+
+@instrumented('tda_batch', lambda result, task_sets: {'task_sets': len(task_sets), 'tasks': sum(map(len, task_sets)),
+                                                      'iterations': result})
+def _tda_batch(task_sets):
+    """Batch TDA for the task sets. Help function for compute_wcrts_batch().
+    Returns the number of iterations of the batch (task sets handled by compute_wcrts() are counted as 'tda')."""
+    # Task sets that cannot be handled with int64
+    batch = []
+    for ts in task_sets:
+        vals = [tsk.rel.miniat for tsk in ts] + [tsk.ex.wcet for tsk in ts]
+        if len(ts) > 0 and all(isinstance(val, (int, np.integer)) and 0 <= val < 2 ** 62 for val in vals):
+            batch.append(ts)
+        else:
+            ts.compute_wcrts()
+    if len(batch) == 0:
+        return 0
+
+    # Padded arrays: padding has miniat=1, wcet=0 and is never active
+    size = max(len(ts) for ts in batch)
+    miniats = np.ones((len(batch), size), dtype=np.int64)
+    wcets = np.zeros((len(batch), size), dtype=np.int64)
+    active = np.zeros((len(batch), size), dtype=bool)
+    for row, ts in enumerate(batch):
+        miniats[row, :len(ts)] = [tsk.rel.miniat for tsk in ts]
+        wcets[row, :len(ts)] = [tsk.ex.wcet for tsk in ts]
+        active[row, :len(ts)] = True
+    wcet_sums = wcets.sum(axis=1)
+    miniat_mins = miniats.min(axis=1)
+    positions = np.arange(size)
+
+    wcrts = wcets.copy()  # WCRT
+    iterations = np.zeros((len(batch), size), dtype=np.int64)
+    fallback = np.zeros(len(batch), dtype=bool)
+    while active.any():
+        # Interference r -> sum(wcet * ceil(r / miniat)) could overflow int64: use compute_wcrts() instead
+        overflow = (wcrts.max(axis=1) / miniat_mins + 1) * wcet_sums >= 2 ** 62
+        if overflow.any():
+            fallback |= overflow
+            active[overflow] = False
+
+        # Only entries that did not converge yet
+        rows, cols = np.nonzero(active)
+        iterations[rows, cols] += 1
+        r = wcrts[rows, cols]
+        hp = positions[None, :] < cols[:, None]  # higher priority tasks
+        interference = (wcets[rows] * -(-r[:, None] // miniats[rows]) * hp).sum(axis=1)
+        grow = r < interference + wcets[rows, cols]
+        wcrts[rows[grow], cols[grow]] = interference[grow] + wcets[rows[grow], cols[grow]]
+        active[rows, cols] = grow
+
+
+    # Write back
+    for row, ts in enumerate(batch):
+        if fallback[row]:
+            ts.compute_wcrts()
+            continue
+        ts.wcrts = {tsk: int(wcrts[row, idx]) for idx, tsk in enumerate(ts)}
+        ts._tda_iterations = {tsk: int(iterations[row, idx]) for idx, tsk in enumerate(ts)}
+        ts._snapshot_wcrt_params()
+    return int(iterations.sum())
 
 
 if __name__ == '__main__':